@@ -1,14 +1,39 @@
 import socket
+import struct
 import threading
 import wave
 import pyaudio
 import time
 import numpy as np
-from scipy import signal
 import soundfile as sf
 import os
 from SipPacket_CoTan import SipPacket
 from RtpPacket_CoTan import RtpPacket
+from PortPool_CoTan import PortPool
+from CallRecorder_CoTan import CallRecorder
+from Resampler_CoTan import resample, to_mono, to_pcm16
+from LatencyProbe_CoTan import LatencyTracker, SenderClock, ntp_timestamp
+
+class _NullStream:
+    """Stand-in for a PyAudio output stream that discards audio (headless mode)"""
+
+    def is_active(self):
+        return True
+
+    def write(self, data):
+        pass
+
+    def stop_stream(self):
+        pass
+
+    def close(self):
+        pass
+
+    def get_write_available(self):
+        return 2**31 - 1
+
+    def get_output_latency(self):
+        return 0.0
 
 class AudioClient:
     """
@@ -25,12 +50,17 @@ class AudioClient:
     CALLER = 0  # Role constant for call initiator
     RECEIVER = 1  # Role constant for call receiver
 
-    def __init__(self, local_ip, local_port, remote_ip, remote_port, role='caller'):
+    def __init__(self, local_ip, local_port, remote_ip, remote_port, role='caller',
+                 port_pool=None, sip_socket=None, headless=False, record_path=None,
+                 latency_probe=False):
         # Network setup
         self.local_ip = local_ip
         self.local_port = int(local_port)
         self.remote_ip = remote_ip
         self.remote_port = int(remote_port)
+        self.remote_rtp_port = None  # Learned from the remote SDP
+        self.owns_port_pool = port_pool is None
+        self.port_pool = PortPool(local_ip) if self.owns_port_pool else port_pool
         
         # Session state
         self.call_id = str(int(time.time()))
@@ -38,42 +68,57 @@ class AudioClient:
         self.session_active = True  # Changed from False to True
         self.is_receiving = False
         self.role = self.CALLER if role.lower() == 'caller' else self.RECEIVER
+        self.headless = headless  # Discard received audio instead of playing it
+        self.record_path = record_path  # May contain {call_id} for one file per call
+        self.latency_probe = latency_probe  # Report per-stage latency histograms
+        self.send_latency = None  # Sender stages, created when streaming starts
+        self.receive_latency = None  # Receiver stages, created when receiving starts
 
         # Audio configuration
         self.CHUNK = 1024
         self.FORMAT = pyaudio.paInt16  # Changed from paULaw to paInt16
         self.CHANNELS = 1
         self.RATE = 8000
-        self.audio = pyaudio.PyAudio()
+        if not self.headless:
+            self.audio = pyaudio.PyAudio()
         
         # Statistics
         self.packets_sent = 0
         self.bytes_sent = 0
+        self.packets_played = 0  # Received packets written to the output stream
         self.start_time = None  # Initialize to None
+        self.last_rtp_send = None  # (wall clock, RTP timestamp) of the latest packet sent
+        self.sender_clock = SenderClock(self.RATE)  # Remote RTP clock from RTCP SR
         
-        # Setup network sockets
-        self.sip_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sip_socket.settimeout(1.0)  # 1 second timeout
-        self.sip_socket.bind((self.local_ip, self.local_port))
-        print(f"\n[SIP] Server listening on {self.local_ip}:{self.local_port}")
+        # Setup network sockets; a shared SIP socket is owned and read by the caller
+        self.owns_sip_socket = sip_socket is None
+        if self.owns_sip_socket:
+            self.sip_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sip_socket.settimeout(1.0)  # 1 second timeout
+            self.sip_socket.bind((self.local_ip, self.local_port))
+            print(f"\n[SIP] Server listening on {self.local_ip}:{self.local_port}")
+        else:
+            self.sip_socket = sip_socket
         
-        self.rtp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.rtp_port = self.local_port + 2
-        self.rtp_socket.bind((self.local_ip, self.rtp_port))
+        # Media sockets come pre-bound from the port pool
+        self.media_ports = self.port_pool.allocate()
+        self.rtp_socket = self.media_ports.rtp_socket
+        self.rtp_port = self.media_ports.rtp_port
+        print(f"[RTP] Media port allocated: {self.rtp_port}")
         
-        # Start listening thread
-        self.listen_thread = threading.Thread(target=self._listen_sip)
-        self.listen_thread.daemon = True
-        self.listen_thread.start()
+        # Start listening thread unless messages are delivered via handle_sip_message
+        if self.owns_sip_socket:
+            self.listen_thread = threading.Thread(target=self._listen_sip)
+            self.listen_thread.daemon = True
+            self.listen_thread.start()
 
         # Setup RTCP
         self._setup_rtcp()
 
     def _setup_rtcp(self):
         """Setup RTCP socket and start RTCP thread"""
-        self.rtcp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.rtcp_port = self.rtp_port + 1
-        self.rtcp_socket.bind((self.local_ip, self.rtcp_port))
+        self.rtcp_socket = self.media_ports.rtcp_socket
+        self.rtcp_port = self.media_ports.rtcp_port
         print(f"[RTCP] Control channel established on port {self.rtcp_port}")
         
         # Start RTCP sender thread
@@ -108,6 +153,7 @@ class AudioClient:
                         rtp_ts = int.from_bytes(data[16:20], byteorder='big')
                         pkts = int.from_bytes(data[20:24], byteorder='big')
                         octets = int.from_bytes(data[24:28], byteorder='big')
+                        self.sender_clock.update(ntp_msw, ntp_lsw, rtp_ts)
                         
                         print("\n[RTCP Report Received]")
                         print("─" * 40)
@@ -125,7 +171,7 @@ class AudioClient:
                 continue
             except socket.error as e:
                 if self.session_active:  # Only log if session is still supposed to be active
-                    if e.winerror != 10054:  # Ignore connection reset errors
+                    if getattr(e, 'winerror', None) != 10054:  # Ignore connection reset errors
                         print(f"[RTCP] Socket error: {e}")
                 continue
             except Exception as e:
@@ -136,15 +182,18 @@ class AudioClient:
     def _rtcp_reporter(self):
         """Periodically send RTCP Sender Reports"""
         last_report_time = 0
+        # Latency mode needs a fresh RTP/NTP mapping to limit pacing drift
+        report_interval = 1 if self.latency_probe else 5
         
         while self.session_active:
             try:
                 current_time = time.time()
-                if current_time - last_report_time >= 5:  # Send report every 5 seconds
+                if current_time - last_report_time >= report_interval:
                     if (self.packets_sent > 0 or hasattr(self, 'packets_received')) and self.start_time:
                         session_duration = current_time - self.start_time
                         
-                        # ... existing RTCP packet creation code ...
+                        if self.packets_sent > 0:
+                            self._send_sender_report(current_time)
                         
                         print("\n[RTCP Report Sent]")
                         print("─" * 40)
@@ -165,6 +214,21 @@ class AudioClient:
                     print(f"[RTCP] Reporter error: {e}")
                 time.sleep(1)
 
+    def _send_sender_report(self, now):
+        """Send an RTCP SR mapping the current wall clock to the RTP clock"""
+        if self.last_rtp_send is None or self.remote_rtp_port is None:
+            return
+        
+        # Extrapolate the RTP clock from the last packet actually sent
+        send_time, send_timestamp = self.last_rtp_send
+        rtp_ts = (send_timestamp + int((now - send_time) * self.RATE)) & 0xFFFFFFFF
+        ntp_msw, ntp_lsw = ntp_timestamp(now)
+        
+        packet = struct.pack('!BBHIIIIII', 0x80, 200, 6,  # V=2, PT=SR, length in words - 1
+                             int(self.call_id) & 0xFFFFFFFF, ntp_msw, ntp_lsw, rtp_ts,
+                             self.packets_sent & 0xFFFFFFFF, self.bytes_sent & 0xFFFFFFFF)
+        self.rtcp_socket.sendto(packet, (self.remote_ip, self.remote_rtp_port + 1))
+
     def start_call(self, audio_file):
         """Initiate SIP call and start streaming audio"""
         try:
@@ -187,8 +251,8 @@ class AudioClient:
                 try:
                     # Wait for response
                     time.sleep(1)
-                    if self.session_active:
-                        # Start streaming audio
+                    if self.session_active and self.remote_rtp_port is not None:
+                        # Start streaming audio once the answer SDP arrived
                         self._stream_audio(audio_file)
                         break
                     retry_count += 1
@@ -215,29 +279,38 @@ class AudioClient:
         sdp += "a=rtpmap:0 PCMU/8000\r\n"
         return sdp
 
+    def _parse_sdp_port(self, message):
+        """Return the RTP port from the m=audio line of a SIP body, if any"""
+        sdp_start = message.find('\r\n\r\n') + 4
+        if sdp_start <= 4:
+            return None
+        for line in message[sdp_start:].split('\n'):
+            if line.startswith('m=audio'):
+                return int(line.split()[1])
+        return None
+
     def _convert_audio_format(self, wf):
         """Convert audio to required format (mono, 8kHz, 16-bit)"""
-        import numpy as np
-        from scipy import signal
-        
         # Read all frames from wave file
         frames = wf.readframes(wf.getnframes())
         
-        # Convert to numpy array
-        samples = np.frombuffer(frames, dtype=np.int16)
+        # Convert to numpy array scaled to the 16-bit range
+        if wf.getsampwidth() == 1:
+            samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float64) - 128) * 256
+        elif wf.getsampwidth() == 4:
+            samples = np.frombuffer(frames, dtype='<i4') / 65536.0
+        else:
+            samples = np.frombuffer(frames, dtype='<i2')
         
-        # Convert stereo to mono if needed
-        if wf.getnchannels() == 2:
-            samples = samples.reshape(-1, 2)
-            samples = samples.mean(axis=1)
+        # Average channels to mono in float so no precision is lost
+        samples = to_mono(samples.reshape(-1, wf.getnchannels()))
         
         # Resample to 8kHz if needed
         if wf.getframerate() != self.RATE:
-            samples = signal.resample(samples, 
-                                    int(len(samples) * self.RATE / wf.getframerate()))
+            samples = resample(samples, wf.getframerate(), self.RATE)
         
-        # Convert back to 16-bit PCM
-        return samples.astype(np.int16).tobytes()
+        # Round and clip back to 16-bit PCM
+        return to_pcm16(samples).tobytes()
 
     def _validate_and_convert_audio(self, audio_file):
         """Validate and convert audio file to WAV format if needed."""
@@ -266,13 +339,12 @@ class AudioClient:
                     # Convert to mono if stereo
                     if len(data.shape) > 1:
                         print("[Audio] Converting stereo to mono...")
-                        data = np.mean(data, axis=1)
+                        data = to_mono(data)
                     
                     # Resample if needed
                     if sample_rate != self.RATE:
                         print(f"[Audio] Resampling from {sample_rate}Hz to {self.RATE}Hz...")
-                        samples = len(data)
-                        data = signal.resample(data, int(samples * self.RATE / sample_rate))
+                        data = resample(data, sample_rate, self.RATE)
                     
                     # Create temporary WAV file
                     temp_path = os.path.join(os.path.dirname(audio_file), 
@@ -328,32 +400,53 @@ class AudioClient:
             # Set start time when streaming actually begins
             self.start_time = time.time()
             seq_num = 0
+            rtp_timestamp = 0  # Sample clock, keeps running across loops
+            if self.latency_probe:
+                self.send_latency = LatencyTracker(LatencyTracker.SENDER_STAGES)
             
-            print(f"\n[RTP] Starting audio stream to {self.remote_ip}:{self.remote_port+2}")
+            if self.remote_rtp_port is None:
+                raise Exception("Remote RTP port unknown - no SDP answer received")
+            print(f"\n[RTP] Starting audio stream to {self.remote_ip}:{self.remote_rtp_port}")
             
+            # Absolute send schedule so sleep overshoot does not accumulate
+            next_send = time.perf_counter()
             while self.session_active:
                 for chunk in chunks:
                     if not self.session_active:
                         break
                         
                     # Create and send RTP packet
+                    packet_start = time.time()
                     rtp_packet = RtpPacket()
                     rtp_packet.encode(2, 0, 0, 0, seq_num, 0, 0, 
-                                    int(self.call_id), chunk)
+                                    int(self.call_id), chunk, rtp_timestamp)
                     
                     packet = rtp_packet.getPacket()
                     print(f"[RTP] Sending packet: {len(packet):,} bytes (Sequence #{seq_num})")
                     
                     self.rtp_socket.sendto(packet,
-                                         (self.remote_ip, self.remote_port + 2))
+                                         (self.remote_ip, self.remote_rtp_port))
+                    self.last_rtp_send = (packet_start, rtp_timestamp)
+                    
+                    if self.send_latency:
+                        # Lateness against the nominal sample clock, then packetise + send
+                        scheduled = self.start_time + rtp_timestamp / self.RATE
+                        self.send_latency.record('Pacing', max(packet_start - scheduled, 0.0))
+                        self.send_latency.record('Encode', time.time() - packet_start)
                     
                     # Update statistics
                     self.packets_sent += 1
                     self.bytes_sent += len(chunk)
                     seq_num += 1
+                    rtp_timestamp += len(chunk) // 2
                     
                     # Control streaming rate
-                    time.sleep(self.CHUNK / self.RATE)  # Sleep for chunk duration
+                    next_send += (len(chunk) // 2) / self.RATE
+                    delay = next_send - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_send = time.perf_counter()  # Fell behind; do not burst to catch up
                 
                 # Loop back to beginning when finished
                 seq_num = 0
@@ -361,6 +454,8 @@ class AudioClient:
         except Exception as e:
             print(f"Error streaming audio: {e}")
         finally:
+            if self.send_latency:
+                self.send_latency.report()
             if 'wf' in locals():
                 wf.close()
             # Clean up temporary file if created
@@ -371,12 +466,12 @@ class AudioClient:
                 except:
                     pass
 
-    def cleanup(self):
+    def cleanup(self, send_bye=True):
         """Clean up resources"""
         print("\n[System] Cleaning up resources")
         
         # Send BYE if we're the one initiating the cleanup
-        if self.session_active:
+        if send_bye and self.session_active:
             try:
                 self.send_bye()
                 # Wait briefly for BYE to be sent and response received
@@ -393,7 +488,7 @@ class AudioClient:
         
         try:
             # Close sockets safely
-            if hasattr(self, 'sip_socket'):
+            if hasattr(self, 'sip_socket') and self.owns_sip_socket:
                 try:
                     self.sip_socket.shutdown(socket.SHUT_RDWR)
                 except:
@@ -413,6 +508,12 @@ class AudioClient:
                 except:
                     pass
                 self.rtcp_socket.close()
+            
+            # Hand the media ports back to the pool for quarantine
+            if hasattr(self, 'media_ports'):
+                self.port_pool.release(self.media_ports)
+            if self.owns_port_pool:
+                self.port_pool.close()
                 
         except Exception as e:
             print(f"[System] Warning during socket cleanup: {e}")
@@ -439,15 +540,7 @@ class AudioClient:
             try:
                 data, addr = self.sip_socket.recvfrom(2048)
                 if data:
-                    message = data.decode()
-                    print(f"\n[SIP] Received message:\n{message}")
-                    
-                    if message.startswith('INVITE'):
-                        self._handle_invite(message, addr)
-                    elif message.startswith('SIP/2.0 200'):
-                        self._handle_ok(message)
-                    elif message.startswith('BYE'):
-                        self._handle_bye(addr)
+                    self.handle_sip_message(data.decode(), addr)
                         
             except socket.timeout:
                 continue
@@ -462,6 +555,17 @@ class AudioClient:
         
         print("[SIP] Listener stopping - session ended")
 
+    def handle_sip_message(self, message, addr):
+        """Dispatch a received SIP message to its handler"""
+        print(f"\n[SIP] Received message:\n{message}")
+        
+        if message.startswith('INVITE'):
+            self._handle_invite(message, addr)
+        elif message.startswith('SIP/2.0 200'):
+            self._handle_ok(message)
+        elif message.startswith('BYE'):
+            self._handle_bye(addr)
+
     def _handle_invite(self, message, addr):
         """Handle incoming INVITE request"""
         print("\n[SIP] Incoming call request received")
@@ -473,6 +577,7 @@ class AudioClient:
                     self.call_id = line.split(':')[1].strip()
                 elif line.startswith('CSeq:'):
                     self.cseq = int(line.split(':')[1].strip().split()[0])
+            self.remote_rtp_port = self._parse_sdp_port(message)
 
             # Send 200 OK with SDP
             response = SipPacket()
@@ -501,13 +606,25 @@ class AudioClient:
         """Receive and play audio packets"""
         p = None
         stream = None
+        recorder = None
         try:
-            p = pyaudio.PyAudio()
-            stream = p.open(format=self.FORMAT,
-                           channels=self.CHANNELS,
-                           rate=self.RATE,
-                           output=True,
-                           frames_per_buffer=self.CHUNK * 4)
+            if self.record_path:
+                try:
+                    recorder = CallRecorder(self.record_path.format(call_id=self.call_id), self.RATE)
+                except Exception as e:
+                    print(f"[Record] Recording disabled: {e}")  # Keep playing without it
+            if self.latency_probe:
+                self.receive_latency = LatencyTracker(LatencyTracker.RECEIVER_STAGES)
+            
+            if self.headless:
+                stream = _NullStream()
+            else:
+                p = pyaudio.PyAudio()
+                stream = p.open(format=self.FORMAT,
+                               channels=self.CHANNELS,
+                               rate=self.RATE,
+                               output=True,
+                               frames_per_buffer=self.CHUNK * 4)
             
             print("\n[Audio] Starting playback - waiting for incoming stream...")
             self.rtp_socket.settimeout(0.5)
@@ -524,6 +641,7 @@ class AudioClient:
             while self.is_receiving:
                 try:
                     data, addr = self.rtp_socket.recvfrom(20480)
+                    arrival = time.time()
                     if data:
                         rtp_packet = RtpPacket()
                         rtp_packet.decode(data)
@@ -532,15 +650,19 @@ class AudioClient:
                         if audio_data:
                             print(f"[RTP] Received packet: {len(data):,} bytes (Sequence #{rtp_packet.seqNum()})")
                             
-                            jitter_buffer.append(audio_data)
+                            if recorder:
+                                recorder.write(rtp_packet.timestamp(), audio_data)
+                            
+                            jitter_buffer.append((audio_data, arrival, rtp_packet.timestamp()))
                             
                             if len(jitter_buffer) >= MIN_BUFFER_SIZE:
                                 while len(jitter_buffer) > 0:
-                                    chunk = jitter_buffer.pop(0)
+                                    entry = jitter_buffer.pop(0)
                                     if stream and stream.is_active():  # Check if stream is still active
-                                        stream.write(chunk)
+                                        self._play_chunk(stream, entry)
                                         packets_received += 1
-                                        bytes_received += len(chunk)
+                                        self.packets_played += 1
+                                        bytes_received += len(entry[0])
                                     
                                     if len(jitter_buffer) < MIN_BUFFER_SIZE:
                                         break
@@ -564,9 +686,14 @@ class AudioClient:
                     if jitter_buffer and self.is_receiving:
                         print("[Audio] Processing remaining buffer...")
                         while jitter_buffer:
-                            chunk = jitter_buffer.pop(0)
-                            if stream and stream.is_active():
-                                stream.write(chunk)
+                            entry = jitter_buffer.pop(0)
+                            try:
+                                if stream and stream.is_active():
+                                    self._play_chunk(stream, entry)
+                                    self.packets_played += 1
+                            except Exception as e:
+                                # Raised here it would escape the receive loop
+                                print(f"[Audio] Error processing packet: {e}")
                     continue
                     
                 except Exception as e:
@@ -579,6 +706,11 @@ class AudioClient:
             
         finally:
             print("[Audio] Cleaning up audio stream")
+            if recorder:
+                recorder.close()
+            if self.receive_latency:
+                self.receive_latency.report()
+                
             try:
                 if stream:
                     if stream.is_active():
@@ -593,21 +725,38 @@ class AudioClient:
             except:
                 pass
 
+    def _play_chunk(self, stream, entry):
+        """Write a jitter buffer entry to the output stream, timing each stage"""
+        chunk, arrival, rtp_timestamp = entry
+        write_start = time.time()
+        stream.write(chunk)
+        if not self.receive_latency:
+            return
+        
+        # Frames still queued ahead of this chunk in the device buffer
+        chunk_frames = len(chunk) // 2
+        queued = max(self.CHUNK * 4 - stream.get_write_available(), chunk_frames) - chunk_frames
+        device = (time.time() - write_start) + queued / self.RATE + stream.get_output_latency()
+        jitter = write_start - arrival
+        self.receive_latency.record('Jitter buffer', jitter)
+        self.receive_latency.record('Device buffer', device)
+        
+        # Network needs the sender's clock, known after its first RTCP SR
+        sent = self.sender_clock.sender_time(rtp_timestamp)
+        if sent is not None:
+            network = arrival - sent
+            self.receive_latency.record('Network', network)
+            self.receive_latency.record('Mouth-to-ear', network + jitter + device)
+
     def _handle_ok(self, message):
         """Handle SIP OK response"""
         if self.role == self.CALLER:
             print(f"\n[SIP] Remote endpoint accepted call")
-            # Parse SDP from response
-            sdp_start = message.find('\r\n\r\n') + 4
-            if sdp_start > 4:
-                sdp = message[sdp_start:]
-                
-                # Extract remote RTP port from SDP
-                for line in sdp.split('\n'):
-                    if line.startswith('m=audio'):
-                        remote_rtp_port = int(line.split()[1])
-                        print(f"[RTP] Remote streaming port: {remote_rtp_port}")
-                        break
+            # Extract remote RTP port from SDP
+            remote_rtp_port = self._parse_sdp_port(message)
+            if remote_rtp_port is not None:
+                self.remote_rtp_port = remote_rtp_port
+                print(f"[RTP] Remote streaming port: {remote_rtp_port}")
                 
                 # Send ACK after processing 200 OK
                 self._send_ack((self.remote_ip, self.remote_port))
@@ -616,6 +765,11 @@ class AudioClient:
                 self.start_time = time.time()
                 print("[SIP] Sending acknowledgement (ACK)")
                 print("\n[Call] Session established - Starting audio stream")
+                
+                # Bidirectional answers (e.g. a conference bridge) send media back
+                if 'a=sendrecv' in message and not self.is_receiving:
+                    print("[Call] Remote endpoint sends audio back - starting playback")
+                    self._start_receiving()
 
     def _handle_bye(self, addr):
         """Handle SIP BYE request"""
@@ -1,48 +1,145 @@
+import os
 import sys
 from AudioClient_CoTan import AudioClient
+from PortPool_CoTan import PortPool
+from SipWorkers_CoTan import SipWorkerPool
+from ConferenceMixer_CoTan import ConferenceBridge
+from RtpRelay_CoTan import RtpRelay
+from Broadcaster_CoTan import Broadcaster
+from CallRecorder_CoTan import CallRecorder
 import time
 
 """
 VoIP Client Launcher
 
 Usage:
-    AudioLauncher.py <local_ip> <local_port> <remote_ip> <remote_port> <audio_file> <role>
-    
+    AudioLauncher.py <local_ip> <local_port> <remote_ip> <remote_port> <audio_file> <role> [options]
+
 Arguments:
     local_ip: IP address to bind to
     local_port: Port to listen on
     remote_ip: Remote endpoint IP
     remote_port: Remote endpoint port
     audio_file: Path to audio file to stream
-    role: Either 'caller' or 'receiver'
+    role: 'caller', 'receiver' or 'conference' (hosts a mix-minus room; callers dial in)
+          or 'relay' (bridges incoming calls to remote_ip:remote_port and forwards media)
+          or 'broadcast' (streams audio_file to remote_ip:remote_port and every --to receiver)
+
+Options:
+    --rtp-ports=MIN-MAX: RTP/RTCP port range (default 10000-20000)
+    --workers=N: Receiver only; serve calls from N processes sharing the SIP port
+    --record=PATH: Record received audio to a .wav or .flac file ({call_id} is replaced)
+    --latency: Report per-stage latency histograms when the stream ends
+    --to=IP:PORT[,IP:PORT...]: Broadcast only; additional receivers to dial
+    --multicast=GROUP:PORT: Broadcast only; also send RTP to a multicast group
+    --loops=N: Broadcast only; play the file N times (default 1)
 """
 
+def parse_options(args):
+    """Parse trailing --key=value options into a dictionary"""
+    options = {}
+    for arg in args:
+        if not arg.startswith('--'):
+            raise ValueError(f"Unexpected argument: {arg}")
+        key, _, value = arg[2:].partition('=')
+        options[key] = value
+    return options
+
+def parse_port_range(value):
+    """Parse a MIN-MAX port range option"""
+    port_min, _, port_max = value.partition('-')
+    return int(port_min), int(port_max)
+
+def check_record_path(path):
+    """Reject a --record path that no call could be recorded to"""
+    try:
+        path = path.format(call_id='0')
+    except (KeyError, IndexError, ValueError):
+        raise ValueError(f"Invalid recording path {path!r}: only {{call_id}} may appear in braces")
+    if os.path.splitext(path)[1].lower() not in CallRecorder.FORMATS:
+        raise ValueError(f"Unsupported recording format. Supported formats: {', '.join(CallRecorder.FORMATS)}")
+
 if __name__ == "__main__":
-    if len(sys.argv) != 7:
-        print("[Usage: AudioLauncher.py <local_ip> <local_port> <remote_ip> <remote_port> <audio_file> <role>]")
-        print("Role must be either 'caller' or 'receiver'")
+    if len(sys.argv) < 7:
+        print("[Usage: AudioLauncher.py <local_ip> <local_port> <remote_ip> <remote_port> <audio_file> <role> [options]]")
+        print("Role must be 'caller', 'receiver', 'conference', 'relay' or 'broadcast'")
+        print("Options: --rtp-ports=MIN-MAX --workers=N --record=PATH --latency "
+              "--to=IP:PORT,... --multicast=GROUP:PORT --loops=N")
         sys.exit(1)
-        
+
     local_ip = sys.argv[1]
     local_port = int(sys.argv[2])
     remote_ip = sys.argv[3]
     remote_port = int(sys.argv[4])
     audio_file = sys.argv[5]
     role = sys.argv[6]
-    
+    options = parse_options(sys.argv[7:])
+    if 'record' in options:
+        try:
+            check_record_path(options['record'])
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
     try:
-        client = AudioClient(local_ip, local_port, remote_ip, remote_port, role)
-        if role.lower() == 'caller':
-            client.start_call(audio_file)
-        else:
-            print(f"Listening for incoming calls on {local_ip}:{local_port}")
+        port_min, port_max = parse_port_range(options.get('rtp-ports', '10000-20000'))
+        
+        if role.lower() == 'conference':
+            port_pool = PortPool(local_ip, port_min, port_max)
+            bridge = ConferenceBridge(local_ip, local_port, port_pool)
+            bridge.start()
+            try:
+                while True:
+                    time.sleep(1)
+            finally:
+                bridge.stop()
+        elif role.lower() == 'relay':
+            port_pool = PortPool(local_ip, port_min, port_max)
+            RtpRelay(local_ip, local_port, remote_ip, remote_port, port_pool).run()
+        elif role.lower() == 'broadcast':
+            port_pool = PortPool(local_ip, port_min, port_max)
+            broadcaster = Broadcaster(local_ip, local_port, port_pool)
+            broadcaster.start()
+            try:
+                destinations = [f"{remote_ip}:{remote_port}"]
+                destinations += [d for d in options.get('to', '').split(',') if d]
+                for destination in destinations:
+                    ip, _, port = destination.rpartition(':')
+                    broadcaster.dial(ip, int(port))
+                if options.get('multicast'):
+                    group, _, port = options['multicast'].rpartition(':')
+                    broadcaster.add_multicast(group, int(port))
+                broadcaster.play(audio_file, int(options.get('loops', 1)))
+            finally:
+                broadcaster.stop()
+        elif 'workers' in options and role.lower() == 'receiver':
+            pool = SipWorkerPool(local_ip, local_port, int(options['workers']),
+                                 port_min, port_max, record_path=options.get('record'),
+                                 latency_probe='latency' in options)
+            pool.start()
             try:
                 while True:
                     time.sleep(1)
-            except KeyboardInterrupt:
-                pass
+            finally:
+                pool.stop()
+        else:
+            port_pool = PortPool(local_ip, port_min, port_max)
+            client = AudioClient(local_ip, local_port, remote_ip, remote_port, role,
+                                 port_pool=port_pool, record_path=options.get('record'),
+                                 latency_probe='latency' in options)
+            if role.lower() == 'caller':
+                client.start_call(audio_file)
+            else:
+                print(f"Listening for incoming calls on {local_ip}:{local_port}")
+                try:
+                    while True:
+                        time.sleep(1)
+                except KeyboardInterrupt:
+                    pass
     except KeyboardInterrupt:
         print("\nExiting...")
     finally:
         if 'client' in locals():
-            client.cleanup()
\ No newline at end of file
+            client.cleanup()
+        if 'port_pool' in locals():
+            port_pool.close()
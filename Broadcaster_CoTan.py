@@ -0,0 +1,316 @@
+import os
+import random
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import soundfile as sf
+from SipPacket_CoTan import SipPacket
+from RtpPacket_CoTan import RtpPacket
+from PortPool_CoTan import PortPool
+from Resampler_CoTan import resample, to_mono, to_pcm16
+
+"""
+One-to-many broadcast streaming
+
+The broadcaster decodes, converts and packetises the audio file once, then
+sends every frame to all subscribers from a single paced loop. Subscribers
+are receivers the broadcaster dials over SIP, plus optionally one IP
+multicast group. Each subscriber has its own SSRC, sequence number and
+timestamp, kept in a small per-subscriber RTP header, and the shared
+payload buffer is sent with it using scatter-gather I/O.
+
+Benchmark usage:
+    Broadcaster_CoTan.py [subscribers ...]
+"""
+
+SENDMSG = hasattr(socket.socket, 'sendmsg')  # Not available on Windows
+
+def load_audio(path, rate=8000):
+    """Decode an audio file to mono 16-bit PCM bytes at `rate`"""
+    data, sample_rate = sf.read(path, dtype='int16')
+    return to_pcm16(resample(to_mono(data), sample_rate, rate)).tobytes()
+
+class Subscriber:
+    """
+    RTP state of one broadcast destination.
+
+    Attributes:
+        header (bytearray): RTP header reused for every packet; only the
+            sequence number and timestamp change
+        call_id (str): SIP dialog of the subscriber, None for multicast
+    """
+
+    def __init__(self, rtp_addr, call_id=None, sip_addr=None):
+        self.rtp_addr = rtp_addr
+        self.call_id = call_id
+        self.sip_addr = sip_addr
+        self.ssrc = random.getrandbits(32)
+        self.seq_num = random.getrandbits(16)
+        self.timestamp = random.getrandbits(32)
+        self.header = bytearray(12)
+        struct.pack_into('!BBHII', self.header, 0, 0x80, 0, self.seq_num, self.timestamp, self.ssrc)
+        self.packets_sent = 0
+
+    def send(self, sock, payload, samples):
+        """Send one shared payload with this subscriber's header"""
+        struct.pack_into('!HI', self.header, 2, self.seq_num, self.timestamp)
+        if SENDMSG:
+            sock.sendmsg([self.header, payload], (), 0, self.rtp_addr)
+        else:
+            sock.sendto(bytes(self.header) + payload, self.rtp_addr)
+        self.seq_num = (self.seq_num + 1) & 0xFFFF
+        self.timestamp = (self.timestamp + samples) & 0xFFFFFFFF
+        self.packets_sent += 1
+
+class Broadcaster:
+    """
+    SIP endpoint streaming one audio source to many subscribers.
+
+    Receivers are dialled with dial(); they join when their 200 OK arrives
+    and leave on BYE, both while the stream is running.
+    """
+
+    FRAME_SIZE = 160  # Samples per packet (20 ms at 8000 Hz)
+    RATE = 8000
+    ANSWER_TIMEOUT = 2.0  # Seconds play() waits for dialled receivers to answer
+
+    def __init__(self, local_ip, local_port, port_pool=None):
+        self.local_ip = local_ip
+        self.local_port = int(local_port)
+        self.owns_port_pool = port_pool is None
+        self.port_pool = PortPool(local_ip) if self.owns_port_pool else port_pool
+        self.pending = {}  # Call-ID -> SIP address of unanswered INVITEs
+        self.subscribers = {}  # Call-ID (or multicast address) -> Subscriber
+        self.targets = ()  # Snapshot of subscribers read by the send loop
+        self.lock = threading.Lock()
+        self.running = False
+
+        self.sip_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sip_socket.settimeout(1.0)
+        self.sip_socket.bind((self.local_ip, self.local_port))
+
+        self.media_ports = self.port_pool.allocate()
+        self.rtp_socket = self.media_ports.rtp_socket
+        self.rtp_port = self.media_ports.rtp_port
+
+    def start(self):
+        """Start handling SIP answers and hang-ups"""
+        self.running = True
+        threading.Thread(target=self._listen_sip, daemon=True).start()
+        print(f"[Broadcast] SIP {self.local_ip}:{self.local_port}, RTP port {self.rtp_port}")
+
+    def stop(self):
+        """Hang up every subscriber and release the sockets"""
+        self.running = False
+        with self.lock:
+            subscribers = list(self.subscribers.values())
+            self.subscribers.clear()
+            self.targets = ()
+        for subscriber in subscribers:
+            if subscriber.call_id is not None:
+                self._send_request('BYE', subscriber.call_id, 2, subscriber.sip_addr)
+        time.sleep(0.1)
+        self.sip_socket.close()
+        self.port_pool.release(self.media_ports)
+        if self.owns_port_pool:
+            self.port_pool.close()
+        print("[Broadcast] Stopped")
+
+    def dial(self, ip, port):
+        """Invite a receiver; it is subscribed once it answers"""
+        call_id = str(random.getrandbits(31))
+        addr = (ip, int(port))
+        self.pending[call_id] = addr
+
+        invite = SipPacket()
+        invite.create_invite(self.local_ip, ip, call_id, 1, self._create_sdp(call_id))
+        self.sip_socket.sendto(invite.encode(), addr)
+        print(f"[Broadcast] Inviting {ip}:{port}")
+
+    def add_multicast(self, group, port, ttl=1):
+        """Also send the stream to an IP multicast group"""
+        self.rtp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.rtp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                   socket.inet_aton(self.local_ip))
+        self._subscribe(f"{group}:{port}", Subscriber((group, int(port))))
+        print(f"[Broadcast] Multicasting to {group}:{port} (TTL {ttl})")
+
+    def play(self, audio_file, loops=1):
+        """Decode the file once and stream it to all subscribers, paced in real time"""
+        deadline = time.time() + self.ANSWER_TIMEOUT
+        while self.pending and time.time() < deadline:
+            time.sleep(0.05)
+
+        print(f"[Audio] Decoding {audio_file}")
+        pcm = memoryview(load_audio(audio_file, self.RATE))
+        frame_bytes = self.FRAME_SIZE * 2
+        frames = [pcm[i:i + frame_bytes] for i in range(0, len(pcm), frame_bytes)]
+        print(f"[Broadcast] {len(frames):,} frames to {len(self.targets)} subscribers")
+
+        next_tick = time.perf_counter()
+        tick = self.FRAME_SIZE / self.RATE
+        for _ in range(loops):
+            for frame in frames:
+                if not self.running:
+                    return
+                samples = len(frame) // 2
+                for subscriber in self.targets:
+                    try:
+                        subscriber.send(self.rtp_socket, frame, samples)
+                    except OSError as e:
+                        print(f"[Broadcast] Send error to {subscriber.rtp_addr}: {e}")
+
+                next_tick += tick
+                delay = next_tick - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_tick = time.perf_counter()  # Fell behind; do not burst to catch up
+
+    def _subscribe(self, key, subscriber):
+        """Add a subscriber and publish a new snapshot to the send loop"""
+        with self.lock:
+            self.subscribers[key] = subscriber
+            self.targets = tuple(self.subscribers.values())
+
+    def _unsubscribe(self, key):
+        """Remove a subscriber and publish a new snapshot to the send loop"""
+        with self.lock:
+            subscriber = self.subscribers.pop(key, None)
+            self.targets = tuple(self.subscribers.values())
+        return subscriber
+
+    def _create_sdp(self, session_id):
+        """Create SDP offer for a send-only stream"""
+        sdp = "v=0\r\n"
+        sdp += f"o=- {session_id} 1 IN IP4 {self.local_ip}\r\n"
+        sdp += "s=Broadcast\r\n"
+        sdp += f"c=IN IP4 {self.local_ip}\r\n"
+        sdp += "t=0 0\r\n"
+        sdp += f"m=audio {self.rtp_port} RTP/AVP 0\r\n"
+        sdp += "a=rtpmap:0 PCMU/8000\r\n"
+        sdp += "a=sendonly\r\n"
+        return sdp
+
+    def _send_request(self, method, call_id, cseq, addr):
+        """Send a body-less request (ACK or BYE) within a dialog"""
+        request = SipPacket()
+        request.method = method
+        request.call_id = call_id
+        request.cseq = cseq
+        request.from_addr = self.local_ip
+        request.to_addr = addr[0]
+        self.sip_socket.sendto(request.encode(), addr)
+
+    def _listen_sip(self):
+        """Subscribe receivers that answer and unsubscribe those that hang up"""
+        while self.running:
+            try:
+                data, addr = self.sip_socket.recvfrom(2048)
+                message = data.decode()
+                headers = {}
+                rtp_ip, rtp_port = addr[0], None
+                for line in message.split('\n'):
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                    if line.startswith('c=IN IP4'):
+                        rtp_ip = line.split()[2]
+                    elif line.startswith('m=audio'):
+                        rtp_port = int(line.split()[1])
+
+                call_id = headers.get('call-id')
+                cseq = int(headers.get('cseq', '0').split()[0])
+
+                if message.startswith('SIP/2.0 200') and call_id in self.pending and rtp_port:
+                    sip_addr = self.pending.pop(call_id)
+                    self._send_request('ACK', call_id, cseq, sip_addr)
+                    self._subscribe(call_id, Subscriber((rtp_ip, rtp_port), call_id, sip_addr))
+                    print(f"[Broadcast] {rtp_ip}:{rtp_port} subscribed ({len(self.targets)} subscribers)")
+                elif message.startswith('BYE'):
+                    response = SipPacket()
+                    response.create_response(200)
+                    response.from_addr = self.local_ip
+                    response.call_id = call_id
+                    response.cseq = cseq
+                    self.sip_socket.sendto(response.encode(), addr)
+                    if self._unsubscribe(call_id) is not None:
+                        print(f"[Broadcast] Call {call_id} left ({len(self.targets)} subscribers)")
+
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self.running:
+                    print(f"[Broadcast] SIP error: {e}")
+
+def _shared_pipeline(path, sock, destinations, rate, frame_size):
+    """Decode once and fan every frame out to all destinations"""
+    pcm = memoryview(load_audio(path, rate))
+    frames = [pcm[i:i + frame_size * 2] for i in range(0, len(pcm), frame_size * 2)]
+    subscribers = [Subscriber(destination) for destination in destinations]
+    for frame in frames:
+        samples = len(frame) // 2
+        for subscriber in subscribers:
+            subscriber.send(sock, frame, samples)
+
+def _per_caller_pipelines(path, sock, destinations, rate, frame_size):
+    """Decode and packetise separately for each destination, as one caller per receiver would"""
+    for ssrc, destination in enumerate(destinations):
+        pcm = load_audio(path, rate)
+        for seq_num, i in enumerate(range(0, len(pcm), frame_size * 2)):
+            rtp_packet = RtpPacket()
+            rtp_packet.encode(2, 0, 0, 0, seq_num, 0, 0, ssrc, pcm[i:i + frame_size * 2], i // 2)
+            sock.sendto(rtp_packet.getPacket(), destination)
+
+def benchmark(sizes=(1, 10, 100, 500), seconds=10.0, local_ip='127.0.0.1'):
+    """Measure CPU per second of audio for one shared pipeline and for per-subscriber pipelines"""
+    rate = Broadcaster.RATE
+    frame_size = Broadcaster.FRAME_SIZE
+    samples = (np.sin(np.arange(int(seconds * 44100)) * 0.05) * 8000).astype(np.int16)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'broadcast_benchmark.wav')
+        sf.write(path, samples, 44100)
+        load_audio(path, rate)  # Exclude filter design and first-use costs
+
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.bind((local_ip, 0))
+        print(f"\n[Benchmark] Broadcasting {seconds:.0f} s of 44.1 kHz audio "
+              f"({len(samples) * rate // 44100 // frame_size:,} frames per subscriber)")
+        print("─" * 66)
+        print(f"{'Subscribers':>11} {'Shared ms/s':>12} {'us/packet':>10} {'Per-caller ms/s':>16} {'Saving':>8}")
+
+        try:
+            for count in sizes:
+                sinks = []
+                for _ in range(count):
+                    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    sink.bind((local_ip, 0))
+                    sinks.append(sink)
+                destinations = [sink.getsockname() for sink in sinks]
+
+                # Send without pacing; CPU time is what matters, not wall time
+                started = time.process_time()
+                _shared_pipeline(path, sender, destinations, rate, frame_size)
+                shared = time.process_time() - started
+
+                started = time.process_time()
+                _per_caller_pipelines(path, sender, destinations, rate, frame_size)
+                per_caller = time.process_time() - started
+
+                packets = -(-len(samples) * rate // 44100 // frame_size) * count
+                print(f"{count:>11} {shared / seconds * 1000:>12.2f} {shared / packets * 1e6:>10.1f} "
+                      f"{per_caller / seconds * 1000:>16.2f} {per_caller / shared:>7.1f}x")
+                for sink in sinks:
+                    sink.close()
+        finally:
+            sender.close()
+
+    print("─" * 66)
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 500]
+    benchmark(sizes)
@@ -0,0 +1,125 @@
+import os
+import queue
+import threading
+import numpy as np
+import soundfile as sf
+
+class CallRecorder:
+    """
+    Records received audio to WAV or FLAC without blocking the media loop.
+
+    Payloads are queued together with their RTP timestamp and written by a
+    background thread in large blocks. Timestamp gaps (lost or dropped
+    packets) are filled with silence so the recording keeps its timing; a
+    late packet replaces its silence if that has not been written yet. When
+    the queue is full the payload is dropped instead of waiting for the disk.
+
+    Attributes:
+        FORMATS (dict): File extension to soundfile format
+        dropped (int): Payloads discarded because the queue was full
+        samples_written (int): Samples written to the file, silence included
+    """
+
+    FORMATS = {'.wav': 'WAV', '.flac': 'FLAC'}
+
+    def __init__(self, path, rate=8000, queue_size=256, flush_seconds=2.0, max_gap_seconds=5.0):
+        file_ext = os.path.splitext(path)[1].lower()
+        if file_ext not in self.FORMATS:
+            raise ValueError(f"Unsupported recording format. Supported formats: {', '.join(self.FORMATS)}")
+
+        self.path = path
+        self.rate = rate
+        self.flush_samples = int(flush_seconds * rate)
+        self.max_gap = int(max_gap_seconds * rate)
+        self.dropped = 0
+        self.samples_written = 0
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.file = sf.SoundFile(path, 'w', rate, 1, 'PCM_16', format=self.FORMATS[file_ext])
+        self.writer_thread = threading.Thread(target=self._writer, daemon=True)
+        self.writer_thread.start()
+        print(f"[Record] Recording received audio to {path}")
+
+    def write(self, timestamp, payload):
+        """Queue a received payload; never blocks"""
+        try:
+            self.queue.put_nowait((timestamp, payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Flush queued audio and close the file"""
+        try:
+            self.queue.put(None, timeout=5.0)
+        except queue.Full:
+            print("[Record] Writer not keeping up - closing without draining queue")
+        self.writer_thread.join(timeout=10.0)
+
+        duration = self.samples_written / self.rate
+        print(f"[Record] Saved {duration:.1f} seconds to {self.path} ({self.dropped} payloads dropped)")
+
+    def _writer(self):
+        """Append queued payloads to the file in large buffered writes"""
+        pending = []
+        pending_samples = 0
+        gaps = []  # (offset in pending, silence, still missing) late packets may fill
+        next_timestamp = None
+
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+
+                timestamp, payload = item
+                samples = np.frombuffer(payload, dtype='<i2')
+                end_timestamp = (timestamp + len(samples)) & 0xFFFFFFFF
+                if next_timestamp is None:
+                    next_timestamp = timestamp
+
+                # Signed distance from where the recording currently ends
+                delta = (timestamp - next_timestamp) & 0xFFFFFFFF
+                if delta >= 0x80000000:
+                    delta -= 0x100000000
+
+                if delta < 0:
+                    # Late: fill any unwritten silence it belongs in
+                    start = pending_samples + delta
+                    for gap_start, silence, missing in gaps:
+                        low = max(start, gap_start)
+                        high = min(start + len(samples), gap_start + len(silence))
+                        if low < high:
+                            fill = missing[low - gap_start:high - gap_start]
+                            silence[low - gap_start:high - gap_start][fill] = samples[low - start:high - start][fill]
+                            fill[:] = False  # A duplicate must not overwrite it again
+                    # Keep only what extends the recording
+                    if -delta >= len(samples):
+                        continue
+                    samples = samples[-delta:]
+                elif delta > 0:
+                    # Packets missing; a huge jump is a restarted stream, not a gap
+                    silence = np.zeros(min(delta, self.max_gap), dtype=np.int16)
+                    if delta <= self.max_gap:
+                        gaps.append((pending_samples, silence, np.ones(len(silence), dtype=bool)))
+                    pending.append(silence)
+                    pending_samples += len(silence)
+
+                pending.append(samples)
+                pending_samples += len(samples)
+                next_timestamp = end_timestamp
+
+                if pending_samples >= self.flush_samples:
+                    self.file.write(np.concatenate(pending))
+                    self.samples_written += pending_samples
+                    pending = []
+                    pending_samples = 0
+                    gaps = []
+
+            if pending:
+                self.file.write(np.concatenate(pending))
+                self.samples_written += pending_samples
+
+        except Exception as e:
+            print(f"[Record] Writer error: {e}")
+        finally:
+            self.file.close()
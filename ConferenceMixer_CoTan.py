@@ -0,0 +1,315 @@
+import random
+import socket
+import sys
+import threading
+import time
+import numpy as np
+from SipPacket_CoTan import SipPacket
+from RtpPacket_CoTan import RtpPacket
+from PortPool_CoTan import PortPool
+
+"""
+N-party conference bridge
+
+Every participant calls the bridge like a normal receiver. Received RTP is
+decoded into a per-participant ring buffer at the position given by its RTP
+timestamp, and every 20 ms the bridge mixes one frame for all participants in
+a single NumPy pass: each participant hears everyone except themselves
+("mix-minus").
+
+Benchmark usage:
+    ConferenceMixer_CoTan.py [participants ...]
+"""
+
+class ConferenceMixer:
+    """
+    Vectorized mix-minus mixer for 16-bit PCM streams.
+
+    Attributes:
+        FRAME_SIZE (int): Samples mixed per tick (20 ms at 8000 Hz)
+        buffers (ndarray): Ring buffer per participant slot, shape (slots, ring)
+        play_pos (int): Absolute sample position of the next frame to mix
+    """
+
+    FRAME_SIZE = 160
+
+    def __init__(self, max_participants=64, rate=8000, playout_delay=0.3, ring_seconds=1.0):
+        self.rate = rate
+        self.max_participants = max_participants
+        # Ring length is a whole number of frames so a frame never wraps
+        ring_frames = max(int(ring_seconds * rate) // self.FRAME_SIZE, 2)
+        self.ring_size = ring_frames * self.FRAME_SIZE
+        self.playout_delay = int(playout_delay * rate)
+        if self.playout_delay + self.FRAME_SIZE >= self.ring_size:
+            raise ValueError("Playout delay must be shorter than the ring buffer")
+
+        self.buffers = np.zeros((max_participants, self.ring_size), dtype=np.int16)
+        self.play_pos = 0
+        self.slots = [None] * max_participants  # (first_timestamp, base_position)
+        self.slot_count = 0  # One past the highest slot in use
+        self.lock = threading.Lock()
+
+    def add_participant(self):
+        """Reserve a mixer slot and return its index"""
+        with self.lock:
+            for slot in range(self.max_participants):
+                if self.slots[slot] is None:
+                    self.slots[slot] = ()  # Anchored on the first packet
+                    self.buffers[slot] = 0
+                    self.slot_count = max(self.slot_count, slot + 1)
+                    return slot
+        raise RuntimeError(f"Conference is full ({self.max_participants} participants)")
+
+    def remove_participant(self, slot):
+        """Release a mixer slot"""
+        with self.lock:
+            self.slots[slot] = None
+            self.buffers[slot] = 0
+            while self.slot_count > 0 and self.slots[self.slot_count - 1] is None:
+                self.slot_count -= 1
+
+    def push(self, slot, timestamp, payload):
+        """Store a received payload at the position of its RTP timestamp"""
+        samples = np.frombuffer(payload, dtype='<i2')
+        with self.lock:
+            anchor = self.slots[slot]
+            if anchor is None:
+                return
+            if not anchor:
+                # First packet plays out `playout_delay` samples from now
+                anchor = (timestamp, self.play_pos + self.playout_delay)
+                self.slots[slot] = anchor
+
+            first_timestamp, base = anchor
+            position = base + ((timestamp - first_timestamp) & 0xFFFFFFFF)
+            if position + len(samples) <= self.play_pos or position >= self.play_pos + self.ring_size:
+                # Sender clock drifted out of the window; restart its playout delay here
+                anchor = (timestamp, self.play_pos + self.playout_delay)
+                self.slots[slot] = anchor
+                position = anchor[1]
+
+            # Drop what is already played out or too far ahead for the ring
+            start = max(position, self.play_pos)
+            end = min(position + len(samples), self.play_pos + self.ring_size)
+            if start >= end:
+                return
+            samples = samples[start - position:end - position]
+
+            offset = start % self.ring_size
+            first = min(len(samples), self.ring_size - offset)
+            self.buffers[slot, offset:offset + first] = samples[:first]
+            self.buffers[slot, :len(samples) - first] = samples[first:]
+
+    def mix(self):
+        """
+        Mix the next frame for every slot in one pass.
+
+        Returns an int16 array of shape (slot_count, FRAME_SIZE) where row i
+        is the sum of all other participants, clipped to 16 bits.
+        """
+        with self.lock:
+            offset = self.play_pos % self.ring_size
+            block = self.buffers[:self.slot_count, offset:offset + self.FRAME_SIZE]
+            frames = block.astype(np.int32)
+            block[:] = 0  # Consumed; missing packets mix as silence next time around
+            self.play_pos += self.FRAME_SIZE
+
+        mixes = frames.sum(axis=0, dtype=np.int32) - frames
+        np.clip(mixes, -32768, 32767, out=mixes)
+        return mixes.astype('<i2')
+
+class Participant:
+    """
+    Media state for one conference leg.
+
+    Attributes:
+        slot (int): Mixer slot receiving this participant's audio
+        rtp_addr (tuple): Address the participant's RTP comes from and goes to
+        ssrc (int): SSRC used on packets sent to this participant
+    """
+
+    def __init__(self, slot, call_id, rtp_addr):
+        self.slot = slot
+        self.call_id = call_id
+        self.rtp_addr = rtp_addr
+        self.ssrc = random.getrandbits(32)
+        self.seq_num = 0
+        self.timestamp = 0
+
+class ConferenceBridge:
+    """
+    SIP endpoint hosting one conference room.
+
+    All participants send RTP to the same bridge port; packets are matched to
+    participants by source address, which is the RTP port from their SDP.
+    """
+
+    TICK = ConferenceMixer.FRAME_SIZE / 8000  # Seconds per mixed frame
+
+    def __init__(self, local_ip, local_port, port_pool=None, max_participants=64):
+        self.local_ip = local_ip
+        self.local_port = int(local_port)
+        self.owns_port_pool = port_pool is None
+        self.port_pool = PortPool(local_ip) if self.owns_port_pool else port_pool
+        self.mixer = ConferenceMixer(max_participants)
+        self.participants = {}  # RTP source address -> Participant
+        self.calls = {}  # (Call-ID, SIP address) -> RTP source address
+        self.running = False
+
+        self.sip_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sip_socket.settimeout(1.0)
+        self.sip_socket.bind((self.local_ip, self.local_port))
+
+        self.media_ports = self.port_pool.allocate()
+        self.rtp_socket = self.media_ports.rtp_socket
+        self.rtp_socket.settimeout(1.0)
+        self.rtp_port = self.media_ports.rtp_port
+
+    def start(self):
+        """Start the SIP, RTP and mixing threads"""
+        self.running = True
+        for target in (self._listen_sip, self._receive_rtp, self._mix_loop):
+            threading.Thread(target=target, daemon=True).start()
+        print(f"[Conference] Room open - SIP {self.local_ip}:{self.local_port}, RTP port {self.rtp_port}")
+
+    def stop(self):
+        """Stop the bridge and release its sockets"""
+        self.running = False
+        time.sleep(0.1)
+        self.sip_socket.close()
+        self.port_pool.release(self.media_ports)
+        if self.owns_port_pool:
+            self.port_pool.close()
+        print("[Conference] Room closed")
+
+    def _create_sdp(self, session_id):
+        """Create SDP answer offering bidirectional audio"""
+        sdp = "v=0\r\n"
+        sdp += f"o=- {session_id} 1 IN IP4 {self.local_ip}\r\n"
+        sdp += "s=Conference\r\n"
+        sdp += f"c=IN IP4 {self.local_ip}\r\n"
+        sdp += "t=0 0\r\n"
+        sdp += f"m=audio {self.rtp_port} RTP/AVP 0\r\n"
+        sdp += "a=rtpmap:0 PCMU/8000\r\n"
+        sdp += "a=sendrecv\r\n"
+        return sdp
+
+    def _listen_sip(self):
+        """Handle INVITE and BYE from participants"""
+        while self.running:
+            try:
+                data, addr = self.sip_socket.recvfrom(2048)
+                message = data.decode()
+                headers = {}
+                rtp_ip, rtp_port = addr[0], None
+                for line in message.split('\n'):
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                    if line.startswith('c=IN IP4'):
+                        rtp_ip = line.split()[2]
+                    elif line.startswith('m=audio'):
+                        rtp_port = int(line.split()[1])
+
+                call_id = headers.get('call-id')
+                # Call-IDs here are timestamps, so also key on the SIP source
+                dialog = (call_id, addr)
+                cseq = int(headers.get('cseq', '0').split()[0])
+                response = SipPacket()
+                response.create_response(200)
+                response.call_id = call_id
+                response.cseq = cseq
+
+                if message.startswith('INVITE') and rtp_port is not None:
+                    if dialog not in self.calls:
+                        rtp_addr = (rtp_ip, rtp_port)
+                        slot = self.mixer.add_participant()
+                        self.participants[rtp_addr] = Participant(slot, call_id, rtp_addr)
+                        self.calls[dialog] = rtp_addr
+                        print(f"[Conference] {rtp_ip}:{rtp_port} joined ({len(self.calls)} participants)")
+                    response.content_type = "application/sdp"
+                    response.content = self._create_sdp(call_id)
+                    self.sip_socket.sendto(response.encode(), addr)
+                elif message.startswith('BYE'):
+                    rtp_addr = self.calls.pop(dialog, None)
+                    if rtp_addr is not None:
+                        participant = self.participants.pop(rtp_addr)
+                        self.mixer.remove_participant(participant.slot)
+                        print(f"[Conference] {rtp_addr[0]}:{rtp_addr[1]} left ({len(self.calls)} participants)")
+                    self.sip_socket.sendto(response.encode(), addr)
+
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self.running:
+                    print(f"[Conference] SIP error: {e}")
+
+    def _receive_rtp(self):
+        """Feed received RTP payloads into the mixer"""
+        while self.running:
+            try:
+                data, addr = self.rtp_socket.recvfrom(20480)
+                participant = self.participants.get(addr)
+                if participant is None:
+                    continue
+                rtp_packet = RtpPacket()
+                rtp_packet.decode(data)
+                self.mixer.push(participant.slot, rtp_packet.timestamp(), rtp_packet.getPayload())
+            except socket.timeout:
+                continue
+            except Exception as e:
+                if self.running:
+                    print(f"[Conference] RTP error: {e}")
+
+    def _mix_loop(self):
+        """Mix and send one frame per tick on an absolute schedule"""
+        next_tick = time.perf_counter()
+        while self.running:
+            mixes = self.mixer.mix()
+            for participant in list(self.participants.values()):
+                if participant.slot >= len(mixes):
+                    continue
+                rtp_packet = RtpPacket()
+                rtp_packet.encode(2, 0, 0, 0, participant.seq_num, 0, 0, participant.ssrc,
+                                  mixes[participant.slot].tobytes(), participant.timestamp)
+                try:
+                    self.rtp_socket.sendto(rtp_packet.getPacket(), participant.rtp_addr)
+                except OSError as e:
+                    print(f"[Conference] Send error to {participant.rtp_addr}: {e}")
+                participant.seq_num = (participant.seq_num + 1) & 0xFFFF
+                participant.timestamp += ConferenceMixer.FRAME_SIZE
+
+            next_tick += self.TICK
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_tick = time.perf_counter()  # Fell behind; do not burst to catch up
+
+def benchmark(sizes=(8, 16, 32, 64, 128), ticks=500):
+    """Time push + mix of one frame tick against the 20 ms budget"""
+    print("\n[Benchmark] Mix-minus per 20 ms frame tick")
+    print("─" * 56)
+    print(f"{'Participants':>12} {'mean us':>10} {'p99 us':>10} {'budget used':>12}")
+    frame = ConferenceMixer.FRAME_SIZE
+    rng = np.random.default_rng(0)
+
+    for size in sizes:
+        mixer = ConferenceMixer(max_participants=size)
+        slots = [mixer.add_participant() for _ in range(size)]
+        payloads = [rng.integers(-8000, 8000, frame, dtype=np.int16).tobytes() for _ in slots]
+        timings = []
+        for tick in range(ticks):
+            started = time.perf_counter()
+            for slot, payload in zip(slots, payloads):
+                mixer.push(slot, tick * frame, payload)
+            mixer.mix()
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        mean = sum(timings) / len(timings) * 1e6
+        p99 = timings[int(len(timings) * 0.99) - 1] * 1e6
+        print(f"{size:>12} {mean:>10.1f} {p99:>10.1f} {p99 / (ConferenceBridge.TICK * 1e6):>11.1%}")
+    print("─" * 56)
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or (8, 16, 32, 64, 128)
+    benchmark(sizes)
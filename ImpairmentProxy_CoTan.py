@@ -0,0 +1,430 @@
+import heapq
+import os
+import random
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+import wave
+import numpy as np
+from AudioClient_CoTan import AudioClient
+from PortPool_CoTan import PortPool
+
+"""
+UDP network impairment proxy
+
+Sits between a caller and a receiver on localhost. SIP is forwarded untouched
+except for the SDP, which is rewritten so media of both directions flows
+through proxy ports. Media packets are then lost, delayed, duplicated or
+reordered according to an impairment profile, using seeded random numbers so
+every run with the same seed and packet sequence is identical.
+
+Usage:
+    ImpairmentProxy_CoTan.py proxy <local_ip> <local_port> <target_ip> <target_port> <profile> [seed]
+    ImpairmentProxy_CoTan.py report [seed]
+
+Profiles:
+    clean, loss-2, loss-10, burst, jitter, reorder, duplicate, congested
+"""
+
+CLIENT_CHUNK = 1024  # Samples per RTP packet sent by AudioClient (its CHUNK)
+PACKET_MS = CLIENT_CHUNK * 1000 / 8000  # Packet period; jitter and reordering are scaled to it
+
+def parse_call_id(message):
+    """Return the Call-ID header value of a SIP message, or None"""
+    for line in message.split('\n'):
+        if line.lower().startswith('call-id:'):
+            return line.split(':', 1)[1].strip()
+    return None
+
+class ImpairmentProfile:
+    """
+    Network conditions applied to one direction of a media stream.
+
+    Attributes:
+        loss (float): Random loss probability (Gilbert-Elliott good state)
+        burst_enter (float): Probability of entering the bad (burst) state per packet
+        burst_exit (float): Probability of leaving the bad state per packet
+        burst_loss (float): Loss probability while in the bad state
+        delay_ms (float): Fixed one-way delay
+        jitter_ms (float): Maximum random deviation added to the delay
+        duplicate (float): Probability a packet is delivered twice
+        reorder (float): Probability a packet is held back by reorder_ms
+        reorder_ms (float): Extra delay applied to reordered packets
+    """
+
+    def __init__(self, name, loss=0.0, burst_enter=0.0, burst_exit=1.0, burst_loss=1.0,
+                 delay_ms=0.0, jitter_ms=0.0, duplicate=0.0, reorder=0.0, reorder_ms=40.0):
+        self.name = name
+        self.loss = loss
+        self.burst_enter = burst_enter
+        self.burst_exit = burst_exit
+        self.burst_loss = burst_loss
+        self.delay_ms = delay_ms
+        self.jitter_ms = jitter_ms
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_ms = reorder_ms
+
+PROFILES = {profile.name: profile for profile in (
+    ImpairmentProfile('clean'),
+    ImpairmentProfile('loss-2', loss=0.02, delay_ms=20),
+    ImpairmentProfile('loss-10', loss=0.10, delay_ms=20),
+    ImpairmentProfile('burst', loss=0.005, burst_enter=0.02, burst_exit=0.25, delay_ms=20),
+    ImpairmentProfile('jitter', delay_ms=PACKET_MS, jitter_ms=PACKET_MS),
+    ImpairmentProfile('reorder', delay_ms=20, reorder=0.05, reorder_ms=1.5 * PACKET_MS),
+    ImpairmentProfile('duplicate', delay_ms=20, duplicate=0.05),
+    ImpairmentProfile('congested', loss=0.01, burst_enter=0.01, burst_exit=0.3,
+                      delay_ms=PACKET_MS, jitter_ms=PACKET_MS / 2, duplicate=0.01,
+                      reorder=0.02, reorder_ms=1.5 * PACKET_MS),
+)}
+
+class Impairment:
+    """Per-direction impairment state driven by a seeded random generator"""
+
+    def __init__(self, profile, seed):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.bad_state = False
+
+    def delays(self):
+        """Return delivery delays in seconds for the next packet ([] if lost)"""
+        profile = self.profile
+        rng = self.rng
+
+        # Gilbert-Elliott two-state burst loss
+        if self.bad_state:
+            self.bad_state = rng.random() >= profile.burst_exit
+        else:
+            self.bad_state = rng.random() < profile.burst_enter
+        loss = profile.burst_loss if self.bad_state else profile.loss
+        if rng.random() < loss:
+            return []
+
+        delay = profile.delay_ms + rng.uniform(-profile.jitter_ms, profile.jitter_ms)
+        if rng.random() < profile.reorder:
+            delay += profile.reorder_ms
+        delays = [max(delay, 0.0) / 1000]
+        if rng.random() < profile.duplicate:
+            delays.append(delays[0] + rng.uniform(0.0, max(profile.jitter_ms, 1.0)) / 1000)
+        return delays
+
+class DeliveryScheduler:
+    """Sends packets at their scheduled delivery time from one thread"""
+
+    def __init__(self):
+        self.queue = []  # Heap of (deliver_at, order, socket, data, addr)
+        self.order = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, deliver_at, sock, data, addr):
+        """Queue a datagram for delivery at a perf_counter time"""
+        with self.condition:
+            heapq.heappush(self.queue, (deliver_at, self.order, sock, data, addr))
+            self.order += 1
+            self.condition.notify()
+
+    def stop(self):
+        """Stop the delivery thread; undelivered packets are discarded"""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout=1.0)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.queue or self.queue[0][0] > time.perf_counter()):
+                    timeout = self.queue[0][0] - time.perf_counter() if self.queue else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                _, _, sock, data, addr = heapq.heappop(self.queue)
+            try:
+                sock.sendto(data, addr)
+            except OSError:
+                pass
+
+class ImpairmentProxy:
+    """
+    SIP-aware UDP proxy impairing the media of every call passing through it.
+
+    Callers dial the proxy's SIP port instead of the receiver. For each call
+    two RTP/RTCP port pairs are allocated: one advertised to the caller and one
+    to the callee, so each side sees the proxy as its media peer.
+    """
+
+    def __init__(self, local_ip, local_port, target_ip, target_port, profile, seed=1,
+                 port_pool=None):
+        self.local_ip = local_ip
+        self.target_addr = (target_ip, int(target_port))
+        self.profile = profile
+        self.seed = seed
+        self.owns_port_pool = port_pool is None
+        self.port_pool = PortPool(local_ip) if self.owns_port_pool else port_pool
+        self.scheduler = DeliveryScheduler()
+        self.selector = selectors.DefaultSelector()
+        self.calls = {}  # Call-ID -> (caller side allocation, callee side allocation)
+        self.routes = {}  # Receiving socket -> [sending socket, destination, Impairment]
+        self.callers = {}  # Call-ID -> SIP address of the caller that placed it
+        self.running = False
+
+        # Downstream socket faces the caller, upstream faces the receiver
+        self.sip_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sip_socket.bind((local_ip, int(local_port)))
+        self.sip_upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sip_upstream.bind((local_ip, 0))
+        self.selector.register(self.sip_socket, selectors.EVENT_READ)
+        self.selector.register(self.sip_upstream, selectors.EVENT_READ)
+
+    def start(self):
+        """Start relaying"""
+        self.running = True
+        threading.Thread(target=self._relay, daemon=True).start()
+        print(f"[Proxy] Impairing media with profile '{self.profile.name}' (seed {self.seed})")
+        print(f"[Proxy] SIP {self.local_ip}:{self.sip_socket.getsockname()[1]} -> "
+              f"{self.target_addr[0]}:{self.target_addr[1]}")
+
+    def stop(self):
+        """Stop relaying and release all media ports"""
+        self.running = False
+        time.sleep(0.2)
+        self.scheduler.stop()
+        for call_id in list(self.calls):
+            self._release_call(call_id)
+        if self.owns_port_pool:
+            self.port_pool.close()
+        self.sip_socket.close()
+        self.sip_upstream.close()
+
+    def _relay(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.5):
+                sock = key.fileobj
+                try:
+                    data, addr = sock.recvfrom(20480)
+                except OSError:
+                    continue
+
+                if sock is self.sip_socket or sock is self.sip_upstream:
+                    try:
+                        self._relay_sip(data, addr, from_caller=sock is self.sip_socket)
+                    except Exception as e:
+                        print(f"[Proxy] Error handling SIP message: {e}")
+                else:
+                    route = self.routes.get(sock)
+                    if route is None or route[1] is None:
+                        continue
+                    out_sock, dest, impairment = route
+                    now = time.perf_counter()
+                    delays = impairment.delays() if impairment else [0.0]
+                    for delay in delays:
+                        self.scheduler.schedule(now + delay, out_sock, data, dest)
+
+    def _relay_sip(self, data, addr, from_caller):
+        """Forward a SIP message to the other side of its call"""
+        message = data.decode(errors='replace')
+        call_id = parse_call_id(message)
+        if call_id is None:
+            return
+
+        if from_caller:
+            self.callers[call_id] = addr
+            self.sip_upstream.sendto(self._rewrite_sip(data, from_caller=True), self.target_addr)
+        else:
+            caller_addr = self.callers.get(call_id)
+            if caller_addr is None:
+                return
+            self.sip_socket.sendto(self._rewrite_sip(data, from_caller=False), caller_addr)
+
+        # The response to a BYE closes the dialog on both sides
+        if message.startswith('SIP/2.0') and call_id not in self.calls:
+            self.callers.pop(call_id, None)
+
+    def _rewrite_sip(self, data, from_caller):
+        """Point the SDP media address of a SIP message at the proxy"""
+        message = data.decode(errors='replace')
+        head, separator, body = message.partition('\r\n\r\n')
+        call_id = parse_call_id(head)
+
+        if message.startswith('BYE') and call_id in self.calls:
+            self._release_call(call_id)
+        if 'm=audio' not in body or call_id is None:
+            return data
+
+        media_ip, media_port = None, None
+        for line in body.split('\r\n'):
+            if line.startswith('c=IN IP4'):
+                media_ip = line.split()[2]
+            elif line.startswith('m=audio'):
+                media_port = int(line.split()[1])
+
+        if call_id not in self.calls:
+            self._setup_call(call_id)
+        caller_side, callee_side = self.calls[call_id]
+
+        # The other endpoint is told to send to `facing`; relay that to this endpoint
+        facing = callee_side if from_caller else caller_side
+        self.routes[facing.rtp_socket][1] = (media_ip, media_port)
+        self.routes[facing.rtcp_socket][1] = (media_ip, media_port + 1)
+
+        lines = []
+        for line in body.split('\r\n'):
+            if line.startswith('c=IN IP4'):
+                line = f"c=IN IP4 {self.local_ip}"
+            elif line.startswith('m=audio'):
+                fields = line.split()
+                fields[1] = str(facing.rtp_port)
+                line = ' '.join(fields)
+            lines.append(line)
+        body = '\r\n'.join(lines)
+
+        head_lines = [f"Content-Length: {len(body)}" if line.lower().startswith('content-length:') else line
+                      for line in head.split('\r\n')]
+        return ('\r\n'.join(head_lines) + separator + body).encode()
+
+    def _setup_call(self, call_id):
+        """Allocate the two media port pairs of a call and register routes"""
+        caller_side = self.port_pool.allocate()
+        callee_side = self.port_pool.allocate()
+        self.calls[call_id] = (caller_side, callee_side)
+
+        # Independent seeded streams per direction keep runs reproducible
+        forward = Impairment(self.profile, f"{self.seed}-{call_id}-fwd")
+        backward = Impairment(self.profile, f"{self.seed}-{call_id}-rev")
+        # Packets arriving on the caller-facing side go to the callee and vice versa
+        self.routes[caller_side.rtp_socket] = [callee_side.rtp_socket, None, forward]
+        self.routes[callee_side.rtp_socket] = [caller_side.rtp_socket, None, backward]
+        self.routes[caller_side.rtcp_socket] = [callee_side.rtcp_socket, None, None]
+        self.routes[callee_side.rtcp_socket] = [caller_side.rtcp_socket, None, None]
+        for allocation in (caller_side, callee_side):
+            self.selector.register(allocation.rtp_socket, selectors.EVENT_READ)
+            self.selector.register(allocation.rtcp_socket, selectors.EVENT_READ)
+        print(f"[Proxy] Call {call_id}: caller media -> port {caller_side.rtp_port}, "
+              f"callee media -> port {callee_side.rtp_port}")
+
+    def _release_call(self, call_id):
+        """Unregister and release the media ports of a call"""
+        for allocation in self.calls.pop(call_id):
+            for sock in (allocation.rtp_socket, allocation.rtcp_socket):
+                self.routes.pop(sock, None)
+                try:
+                    self.selector.unregister(sock)
+                except (KeyError, ValueError):
+                    pass
+            self.port_pool.release(allocation)
+
+def _write_tone(path, packets, chunk=CLIENT_CHUNK, rate=8000):
+    """Write a mono 16-bit WAV long enough for `packets` client packets"""
+    samples = (np.sin(2 * np.pi * 440 * np.arange(packets * chunk) / rate) * 8000).astype('<i2')
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(samples.tobytes())
+
+def measure_profile(profile, seed=1, packets=100, port_pool=None):
+    """
+    Place one call between two headless AudioClients through the proxy.
+
+    The caller streams `packets` packets of a test tone; the receiver runs the
+    client's own jitter buffer and playout path with latency probing on.
+    Returns packets sent, packets played and the receiver's latency tracker.
+    """
+    owns_port_pool = port_pool is None
+    port_pool = PortPool('127.0.0.1') if owns_port_pool else port_pool
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    caller = receiver = proxy = None
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            audio_file = os.path.join(directory, 'tone.wav')
+            _write_tone(audio_file, packets)
+
+            receiver = AudioClient('127.0.0.1', 0, '127.0.0.1', 0, 'receiver', port_pool=port_pool,
+                                   headless=True, latency_probe=True)
+            proxy = ImpairmentProxy('127.0.0.1', 0, '127.0.0.1', receiver.sip_socket.getsockname()[1],
+                                    profile, seed, port_pool)
+            proxy.start()
+            caller = AudioClient('127.0.0.1', 0, '127.0.0.1', proxy.sip_socket.getsockname()[1], 'caller',
+                                 port_pool=port_pool, headless=True)
+            # A fixed Call-ID keeps the proxy's per-call random streams reproducible
+            caller.call_id = str(seed)
+            threading.Thread(target=caller.start_call, args=(audio_file,), daemon=True).start()
+
+            deadline = time.time() + 5.0 + packets * CLIENT_CHUNK / 8000 * 2
+            while caller.packets_sent < packets and time.time() < deadline:
+                time.sleep(0.05)
+            caller.session_active = False  # Stop streaming
+            # In-flight packets arrive and the receiver's idle timeout drains its buffer
+            time.sleep(1.0 + (profile.delay_ms + profile.jitter_ms + profile.reorder_ms) / 1000)
+            caller.send_bye()
+            time.sleep(1.0)  # Receive loop notices the BYE and finishes playback
+            return {'sent': caller.packets_sent, 'played': receiver.packets_played,
+                    'latency': receiver.receive_latency}
+    finally:
+        for client in (caller, receiver):
+            if client is not None:
+                client.cleanup(send_bye=False)
+        if proxy is not None:
+            proxy.stop()
+        if owns_port_pool:
+            port_pool.close()
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def report(seed=1, profiles=None, packets=100):
+    """Print packets played and receiver latency for each profile"""
+    profiles = profiles or list(PROFILES)
+    print(f"\n[Report] {packets} packets of {CLIENT_CHUNK} samples ({PACKET_MS:g} ms) per profile "
+          f"between headless AudioClients, seed {seed}")
+    print("Latency in ms: mean, and p95 as a histogram bucket upper edge")
+    print("─" * 88)
+    print(f"{'Profile':<11} {'Sent':>6} {'Played':>7} {'Played %':>9} {'Jitter avg':>11} "
+          f"{'Jitter p95':>11} {'Mouth-ear avg':>14} {'Mouth-ear p95':>14}")
+    port_pool = PortPool('127.0.0.1')
+    try:
+        for name in profiles:
+            stats = measure_profile(PROFILES[name], seed, packets, port_pool)
+            columns = []
+            for stage in ('Jitter buffer', 'Mouth-to-ear'):
+                histogram = stats['latency'].histograms[stage] if stats['latency'] else None
+                if histogram and histogram.count:
+                    columns += [f"{histogram.total / histogram.count:.0f}", f"{histogram.percentile(0.95):g}"]
+                else:
+                    columns += ['-', '-']
+            played = stats['played'] / stats['sent'] if stats['sent'] else 0.0
+            print(f"{name:<11} {stats['sent']:>6} {stats['played']:>7} {played:>9.1%} {columns[0]:>11} "
+                  f"{columns[1]:>11} {columns[2]:>14} {columns[3]:>14}")
+    finally:
+        port_pool.close()
+    print("─" * 88)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 7 and sys.argv[1] == 'proxy':
+        if sys.argv[6] not in PROFILES:
+            print(f"Unknown profile. Profiles: {', '.join(PROFILES)}")
+            sys.exit(1)
+        seed = int(sys.argv[7]) if len(sys.argv) > 7 else 1
+        proxy = ImpairmentProxy(sys.argv[2], int(sys.argv[3]), sys.argv[4], int(sys.argv[5]),
+                                PROFILES[sys.argv[6]], seed)
+        proxy.start()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print("\nExiting...")
+        finally:
+            proxy.stop()
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'report':
+        report(int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+    else:
+        print("[Usage: ImpairmentProxy_CoTan.py proxy <local_ip> <local_port> <target_ip> <target_port> <profile> [seed]]")
+        print("[       ImpairmentProxy_CoTan.py report [seed]]")
+        print(f"Profiles: {', '.join(PROFILES)}")
+        sys.exit(1)
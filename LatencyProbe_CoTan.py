@@ -0,0 +1,123 @@
+import bisect
+import threading
+
+NTP_EPOCH_OFFSET = 2208988800  # Seconds from 1900 (NTP) to 1970 (Unix)
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Attributes:
+        EDGES_MS (tuple): Upper bucket edges in milliseconds; the last bucket is open
+        counts (list): Samples per bucket
+    """
+
+    EDGES_MS = (1, 2, 5, 10, 20, 50, 100, 150, 200, 300, 500, 750, 1000, 2000)
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * (len(self.EDGES_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        """Add one latency sample given in seconds"""
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(self.EDGES_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def percentile(self, fraction):
+        """Return the bucket edge (ms) below which `fraction` of samples fall"""
+        target = fraction * self.count
+        seen = 0
+        for edge, count in zip(self.EDGES_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return edge
+        return self.max
+
+    def report(self):
+        """Print summary statistics and the bucket distribution"""
+        print(f"\n[Latency] {self.name}")
+        print("─" * 40)
+        if not self.count:
+            print("No samples")
+            print("─" * 40)
+            return
+
+        print(f"Samples: {self.count:,}")
+        print(f"Mean: {self.total / self.count:.1f} ms (min {self.min:.1f}, max {self.max:.1f})")
+        print(f"p50 <= {self.percentile(0.5):g} ms, p95 <= {self.percentile(0.95):g} ms, "
+              f"p99 <= {self.percentile(0.99):g} ms")
+
+        peak = max(self.counts)
+        labels = [f"< {edge} ms" for edge in self.EDGES_MS] + [f">= {self.EDGES_MS[-1]} ms"]
+        for label, count in zip(labels, self.counts):
+            if count:
+                print(f"{label:>11} | {'█' * max(1, count * 20 // peak):<20} {count:,}")
+        print("─" * 40)
+
+class LatencyTracker:
+    """
+    Per-stage latency histograms for one endpoint.
+
+    Sender stages: pacing (lateness against the RTP sample clock) and encode
+    (packetising and sending). Receiver stages: network (arrival against the
+    sender's clock mapped through RTCP SR), jitter buffer, device buffer and
+    their sum as mouth-to-ear.
+    """
+
+    SENDER_STAGES = ('Pacing', 'Encode')
+    RECEIVER_STAGES = ('Network', 'Jitter buffer', 'Device buffer', 'Mouth-to-ear')
+
+    def __init__(self, stages):
+        self.histograms = {stage: LatencyHistogram(stage) for stage in stages}
+        self.lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        """Add a sample to one stage"""
+        with self.lock:
+            self.histograms[stage].record(seconds)
+
+    def report(self):
+        """Print the histogram of every stage"""
+        with self.lock:
+            for histogram in self.histograms.values():
+                histogram.report()
+
+class SenderClock:
+    """
+    Maps RTP timestamps to the sender's wall clock using RTCP Sender Reports.
+
+    Until the first SR arrives no mapping exists and sender_time returns None.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.mapping = None  # (sender wall clock, RTP timestamp)
+
+    def update(self, ntp_msw, ntp_lsw, rtp_timestamp):
+        """Store the NTP/RTP pair carried by a Sender Report"""
+        wall_clock = ntp_msw - NTP_EPOCH_OFFSET + ntp_lsw / 2**32
+        self.mapping = (wall_clock, rtp_timestamp)
+
+    def sender_time(self, rtp_timestamp):
+        """Return the sender wall-clock time of an RTP timestamp"""
+        if self.mapping is None:
+            return None
+        wall_clock, reference = self.mapping
+        delta = (rtp_timestamp - reference) & 0xFFFFFFFF
+        if delta >= 0x80000000:
+            delta -= 0x100000000
+        return wall_clock + delta / self.rate
+
+def ntp_timestamp(unix_time):
+    """Return (msw, lsw) NTP timestamp words for a Unix time"""
+    ntp = unix_time + NTP_EPOCH_OFFSET
+    msw = int(ntp)
+    return msw & 0xFFFFFFFF, int((ntp - msw) * 2**32) & 0xFFFFFFFF
@@ -0,0 +1,181 @@
+import socket
+import threading
+import time
+from collections import deque
+
+class PortAllocation:
+    """
+    RTP/RTCP port pair handed out by a PortPool.
+
+    Attributes:
+        rtp_port (int): Even port used for RTP media
+        rtcp_port (int): Odd port (rtp_port + 1) used for RTCP
+        rtp_socket (socket): UDP socket already bound to rtp_port
+        rtcp_socket (socket): UDP socket already bound to rtcp_port
+    """
+
+    def __init__(self, rtp_port, rtp_socket, rtcp_socket):
+        self.rtp_port = rtp_port
+        self.rtcp_port = rtp_port + 1
+        self.rtp_socket = rtp_socket
+        self.rtcp_socket = rtcp_socket
+
+class PortPool:
+    """
+    Allocator for RTP/RTCP port pairs from a configurable range.
+
+    RTP always gets the even port of a pair and RTCP the odd port right above
+    it (RFC 3550). A few pairs are kept bound ahead of time so that call setup
+    does not wait on socket creation, and released pairs are quarantined for a
+    short time so late packets from a finished call never reach the next one.
+
+    Attributes:
+        DEFAULT_RANGE (tuple): Default (first, last) port range
+        DEFAULT_QUARANTINE (float): Seconds a released pair stays unavailable
+        DEFAULT_PREBIND (int): Number of pairs kept bound ahead of time
+    """
+
+    DEFAULT_RANGE = (10000, 20000)
+    DEFAULT_QUARANTINE = 2.0
+    DEFAULT_PREBIND = 2
+
+    def __init__(self, local_ip, port_min=None, port_max=None,
+                 quarantine=DEFAULT_QUARANTINE, prebind=DEFAULT_PREBIND):
+        if port_min is None:
+            port_min = self.DEFAULT_RANGE[0]
+        if port_max is None:
+            port_max = self.DEFAULT_RANGE[1]
+
+        # RTP must start on an even port and RTCP needs the odd port above it
+        first = port_min + (port_min % 2)
+        if first + 1 > port_max:
+            raise ValueError(f"Port range {port_min}-{port_max} holds no RTP/RTCP pair")
+
+        self.local_ip = local_ip
+        self.port_min = first
+        self.port_max = port_max
+        self.quarantine = quarantine
+        self.prebind = prebind
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)  # Signals the filler thread
+        self._free = deque(range(first, port_max, 2))  # Even RTP ports
+        self._quarantined = deque()  # (release_time, rtp_port)
+        self._ready = deque()  # Pre-bound PortAllocation objects
+        self._in_use = set()
+        self._closed = False
+
+        # One long-lived thread keeps `prebind` pairs bound for allocate()
+        self._filler = threading.Thread(target=self._fill_ready, daemon=True)
+        self._filler.start()
+
+    def __len__(self):
+        """Return number of pairs that can still be allocated."""
+        with self._lock:
+            self._expire_quarantine()
+            return len(self._free) + len(self._ready)
+
+    def allocate(self):
+        """Return a bound PortAllocation, raising RuntimeError if exhausted."""
+        with self._lock:
+            self._expire_quarantine()
+            if self._ready:
+                allocation = self._ready.popleft()
+                self._in_use.add(allocation.rtp_port)
+                self._wakeup.notify()
+                return allocation
+            attempts = len(self._free)
+
+        # Nothing pre-bound: bind a pair here, without holding the lock
+        for _ in range(attempts):
+            allocation = self._bind_next()
+            if allocation is None:
+                break
+            with self._lock:
+                self._in_use.add(allocation.rtp_port)
+                self._wakeup.notify()
+            return allocation
+        raise RuntimeError(f"No free RTP ports in range {self.port_min}-{self.port_max}")
+
+    def release(self, allocation):
+        """Close the sockets of an allocation and quarantine its ports."""
+        for sock in (allocation.rtp_socket, allocation.rtcp_socket):
+            try:
+                sock.close()
+            except:
+                pass
+
+        with self._lock:
+            if allocation.rtp_port in self._in_use:
+                self._in_use.discard(allocation.rtp_port)
+                self._quarantined.append((time.monotonic(), allocation.rtp_port))
+
+    def close(self):
+        """Close every pre-bound pair held by the pool and stop the filler thread."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+            while self._ready:
+                allocation = self._ready.popleft()
+                allocation.rtp_socket.close()
+                allocation.rtcp_socket.close()
+                self._free.append(allocation.rtp_port)
+
+    def _fill_ready(self):
+        """Filler thread: bind pairs ahead of time until `prebind` are waiting."""
+        while True:
+            with self._lock:
+                while not self._closed and len(self._ready) >= self.prebind:
+                    self._wakeup.wait()
+                if self._closed:
+                    return
+                self._expire_quarantine()
+                has_free = bool(self._free)
+            allocation = self._bind_next() if has_free else None
+            if allocation is None:
+                # Range exhausted for now; retry once quarantined pairs expire
+                with self._lock:
+                    if not self._closed:
+                        self._wakeup.wait(self.quarantine)
+                continue
+            with self._lock:
+                if not self._closed:
+                    self._ready.append(allocation)
+                    continue
+                self._free.append(allocation.rtp_port)
+            allocation.rtp_socket.close()
+            allocation.rtcp_socket.close()
+            return
+
+    def _expire_quarantine(self):
+        """Move pairs whose quarantine elapsed back to the free list."""
+        now = time.monotonic()
+        while self._quarantined and now - self._quarantined[0][0] >= self.quarantine:
+            self._free.append(self._quarantined.popleft()[1])
+
+    def _bind_next(self):
+        """Bind the next free pair, skipping ports already taken on the host.
+
+        The lock is only held to take a port off the free list or put it back;
+        the bind() calls happen outside it.
+        """
+        with self._lock:
+            attempts = len(self._free)
+        for _ in range(attempts):
+            with self._lock:
+                if not self._free:
+                    return None
+                rtp_port = self._free.popleft()
+            rtp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            rtcp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                rtp_socket.bind((self.local_ip, rtp_port))
+                rtcp_socket.bind((self.local_ip, rtp_port + 1))
+                return PortAllocation(rtp_port, rtp_socket, rtcp_socket)
+            except OSError:
+                # Port held by another process; retry it after everything else
+                rtp_socket.close()
+                rtcp_socket.close()
+                with self._lock:
+                    self._free.append(rtp_port)
+        return None
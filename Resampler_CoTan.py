@@ -0,0 +1,146 @@
+import functools
+import sys
+import time
+from math import gcd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+
+"""
+Rational-ratio polyphase resampler
+
+Resampling by up/down is done with one FIR low-pass filter split into `up`
+polyphase branches, so only the input samples that contribute to an output
+sample are ever multiplied. Filter banks are designed once per
+(source rate, target rate) pair and cached. PolyphaseResampler keeps its
+filter history between calls so audio can be converted block by block.
+
+Benchmark usage:
+    Resampler_CoTan.py [seconds]
+"""
+
+BLOCK_SIZE = 2048  # Input samples per block; larger blocks fall out of cache
+
+@functools.lru_cache(maxsize=32)
+def filter_bank(src_rate, dst_rate):
+    """
+    Return (up, down, bank, delay) for converting src_rate to dst_rate.
+
+    bank has shape (up, taps) and holds each polyphase branch reversed, so an
+    output sample is the dot product of one row with a window of the input.
+    delay is the filter's group delay in upsampled samples.
+    """
+    divisor = gcd(int(src_rate), int(dst_rate))
+    up = int(dst_rate) // divisor
+    down = int(src_rate) // divisor
+    if up == down:
+        return 1, 1, np.ones((1, 1)), 0
+
+    # Kaiser-windowed low-pass at the lower of the two Nyquist rates
+    half_len = 10 * max(up, down)
+    prototype = signal.firwin(2 * half_len + 1, 1.0 / max(up, down), window=('kaiser', 5.0)) * up
+
+    taps = -(-len(prototype) // up)
+    padded = np.zeros(up * taps)
+    padded[:len(prototype)] = prototype
+    bank = padded.reshape(taps, up).T[:, ::-1].copy()
+    bank.setflags(write=False)
+    return up, down, bank, half_len
+
+class PolyphaseResampler:
+    """
+    Streaming resampler for one channel.
+
+    Attributes:
+        up (int): Interpolation factor
+        down (int): Decimation factor
+        bank (ndarray): Cached polyphase filter bank shared by all instances
+    """
+
+    def __init__(self, src_rate, dst_rate):
+        self.up, self.down, self.bank, self.delay = filter_bank(src_rate, dst_rate)
+        self.taps = self.bank.shape[1]
+        self.history = np.zeros(self.taps - 1)
+        self.samples_in = 0  # Input samples consumed so far
+        self.samples_out = 0  # Output samples produced so far
+
+    def process(self, block):
+        """Resample a block of samples and return every output now available"""
+        block = np.asarray(block, dtype=np.float64)
+        buffer = np.concatenate((self.history, block))
+        available = self.samples_in + len(block)
+
+        # Output n sits at upsampled position n*down + delay, centring the filter
+        end = max((available * self.up - self.delay + self.down - 1) // self.down, self.samples_out)
+        positions = np.arange(self.samples_out, end, dtype=np.int64) * self.down + self.delay
+        phases = positions % self.up
+        rows = positions // self.up - self.samples_in
+
+        windows = sliding_window_view(buffer, self.taps)
+        output = np.einsum('nk,nk->n', self.bank[phases], windows[rows])
+
+        self.history = buffer[len(buffer) - (self.taps - 1):]
+        self.samples_in = available
+        self.samples_out = end
+        return output
+
+    def flush(self):
+        """Return the remaining output samples of the stream"""
+        remaining = -(-self.samples_in * self.up // self.down) - self.samples_out
+        if remaining <= 0:
+            return np.zeros(0)
+        # Zeros past the end let the centred filter reach the last outputs
+        padding = np.zeros(-(-self.delay // self.up) + self.taps)
+        return self.process(padding)[:remaining]
+
+def resample(samples, src_rate, dst_rate):
+    """Resample a whole signal (1-D) and return float64 samples"""
+    samples = np.asarray(samples, dtype=np.float64)
+    if src_rate == dst_rate:
+        return samples.copy()
+
+    resampler = PolyphaseResampler(src_rate, dst_rate)
+    total = -(-len(samples) * resampler.up // resampler.down)
+    parts = [resampler.process(samples[i:i + BLOCK_SIZE]) for i in range(0, len(samples), BLOCK_SIZE)]
+    parts.append(resampler.flush())
+    return np.concatenate(parts)[:total]
+
+def to_mono(samples):
+    """Average interleaved or (frames, channels) audio to mono in float64"""
+    samples = np.asarray(samples)
+    if samples.ndim == 1:
+        return samples.astype(np.float64)
+    return samples.mean(axis=1, dtype=np.float64)
+
+def to_pcm16(samples):
+    """Round and clip float samples to 16-bit PCM"""
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+def benchmark(seconds=30.0, dst_rate=8000, block=1024):
+    """Measure resampling throughput in input samples per second"""
+    print(f"\n[Benchmark] Polyphase resampling to {dst_rate} Hz ({seconds:.0f} s of audio)")
+    print("─" * 64)
+    print(f"{'Source':>8} {'Taps':>6} {'One-shot Msps':>14} {'Streaming Msps':>15} {'x realtime':>11}")
+    rng = np.random.default_rng(0)
+
+    for src_rate in (44100, 48000, 16000):
+        samples = rng.standard_normal(int(seconds * src_rate)) * 8000
+        resample(samples[:BLOCK_SIZE], src_rate, dst_rate)  # Exclude filter design and warm-up
+
+        started = time.perf_counter()
+        resample(samples, src_rate, dst_rate)
+        one_shot = len(samples) / (time.perf_counter() - started)
+
+        resampler = PolyphaseResampler(src_rate, dst_rate)
+        started = time.perf_counter()
+        for i in range(0, len(samples), block):
+            resampler.process(samples[i:i + block])
+        resampler.flush()
+        streaming = len(samples) / (time.perf_counter() - started)
+
+        print(f"{src_rate:>8} {resampler.taps:>6} {one_shot / 1e6:>14.2f} {streaming / 1e6:>15.2f} "
+              f"{streaming / src_rate:>11.0f}")
+    print("─" * 64)
+
+if __name__ == "__main__":
+    benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 30.0)
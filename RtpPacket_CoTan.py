@@ -16,9 +16,11 @@ class RtpPacket:
         self.header = bytearray(self.HEADER_SIZE)
         self.payload = None
         
-    def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload):
+    def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, timestamp=None):
         """Encode the RTP packet with header fields and payload."""
-        timestamp = int(time())
+        if timestamp is None:
+            timestamp = int(time())
+        timestamp &= 0xFFFFFFFF
         
         # Fill the header bytearray with RTP header fields
         self.header[0] = (version << 6) | (padding << 5) | (extension << 4) | cc
@@ -47,6 +49,14 @@ class RtpPacket:
         seqNum = self.header[2] << 8 | self.header[3]
         return int(seqNum)
     
+    def timestamp(self):
+        """Return RTP timestamp."""
+        return int.from_bytes(self.header[4:8], byteorder='big')
+    
+    def ssrc(self):
+        """Return synchronization source identifier."""
+        return int.from_bytes(self.header[8:12], byteorder='big')
+    
     def getPayload(self):
         """Return payload."""
         return self.payload
@@ -0,0 +1,383 @@
+import multiprocessing
+import random
+import selectors
+import socket
+import struct
+import sys
+import time
+from SipPacket_CoTan import SipPacket
+from PortPool_CoTan import PortPool
+
+"""
+Back-to-back RTP relay
+
+The relay answers calls on its SIP port and places a second call to a fixed
+target, then forwards media between the two legs without decoding it. Each
+datagram is received into a preallocated buffer, its SSRC, sequence number
+and timestamp are rewritten in place, and the same buffer is sent on, so the
+payload is never copied.
+
+Benchmark usage:
+    RtpRelay_CoTan.py [seconds]
+"""
+
+BUFFER_SIZE = 2048
+
+class HeaderRewriter:
+    """
+    SSRC/sequence/timestamp rewrite state for one direction of a call.
+
+    Outgoing numbering starts at random values and stays continuous when the
+    incoming stream changes SSRC; the timestamp then advances by the elapsed
+    wall-clock time.
+    """
+
+    def __init__(self, rate=8000):
+        self.rate = rate
+        self.ssrc = random.getrandbits(32)
+        self.source_ssrc = None
+        self.seq_offset = 0
+        self.ts_offset = 0
+        self.last_seq = random.getrandbits(16)
+        self.last_ts = random.getrandbits(32)
+        self.last_time = None
+
+    def rtp(self, buffer):
+        """Rewrite the header of the RTP packet at the start of buffer"""
+        seq_num, timestamp, ssrc = struct.unpack_from('!HII', buffer, 2)
+        now = time.monotonic()
+        if ssrc != self.source_ssrc:
+            gap = int((now - self.last_time) * self.rate) if self.last_time else 0
+            self.seq_offset = (self.last_seq + 1 - seq_num) & 0xFFFF
+            self.ts_offset = (self.last_ts + gap - timestamp) & 0xFFFFFFFF
+            self.source_ssrc = ssrc
+
+        self.last_seq = (seq_num + self.seq_offset) & 0xFFFF
+        self.last_ts = (timestamp + self.ts_offset) & 0xFFFFFFFF
+        self.last_time = now
+        struct.pack_into('!HII', buffer, 2, self.last_seq, self.last_ts, self.ssrc)
+
+    def rtcp(self, buffer, length):
+        """Rewrite the sender SSRC (and SR timestamp) of the first RTCP packet"""
+        packet_type = buffer[1]
+        if packet_type in (200, 201) and length >= 8:  # SR, RR
+            struct.pack_into('!I', buffer, 4, self.ssrc)
+        if packet_type == 200 and length >= 20:
+            timestamp, = struct.unpack_from('!I', buffer, 16)
+            struct.pack_into('!I', buffer, 16, (timestamp + self.ts_offset) & 0xFFFFFFFF)
+
+class MediaPath:
+    """
+    One forwarding direction: receive on one leg, send from the other.
+
+    Attributes:
+        in_socket (socket): Socket the packets arrive on
+        out_socket (socket): Socket they leave from, so the peer sees one address
+        destination (tuple): Remote media address, None until known from SDP
+    """
+
+    def __init__(self, in_socket, out_socket, rewriter, is_rtcp=False):
+        self.in_socket = in_socket
+        self.out_socket = out_socket
+        self.rewriter = rewriter
+        self.is_rtcp = is_rtcp
+        self.destination = None
+        self.buffer = bytearray(BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.forwarded = 0
+
+    def forward(self):
+        """Relay one datagram without copying its payload"""
+        length, _ = self.in_socket.recvfrom_into(self.buffer)
+        if self.destination is None or length < 8 or self.buffer[0] >> 6 != 2:
+            return
+        if self.is_rtcp:
+            self.rewriter.rtcp(self.buffer, length)
+        elif length >= 12:
+            self.rewriter.rtp(self.buffer)
+        else:
+            return
+        self.out_socket.sendto(self.view[:length], self.destination)
+        self.forwarded += 1
+
+class RelayCall:
+    """
+    Two SIP dialogs bridged by the relay and their media paths.
+
+    Leg A faces the caller that dialled the relay, leg B the target.
+    """
+
+    def __init__(self, caller_call_id, caller_addr, caller_cseq, leg_a, leg_b):
+        self.caller_call_id = caller_call_id
+        self.caller_addr = caller_addr
+        self.caller_cseq = caller_cseq
+        self.target_call_id = f"{caller_call_id}-b2b{random.getrandbits(24)}"
+        self.leg_a = leg_a
+        self.leg_b = leg_b
+
+        forward, backward = HeaderRewriter(), HeaderRewriter()
+        self.paths = [
+            MediaPath(leg_a.rtp_socket, leg_b.rtp_socket, forward),
+            MediaPath(leg_a.rtcp_socket, leg_b.rtcp_socket, forward, is_rtcp=True),
+            MediaPath(leg_b.rtp_socket, leg_a.rtp_socket, backward),
+            MediaPath(leg_b.rtcp_socket, leg_a.rtcp_socket, backward, is_rtcp=True),
+        ]
+
+    def set_caller_media(self, addr):
+        """Media from leg B goes to the caller's RTP/RTCP ports"""
+        self.paths[2].destination = addr
+        self.paths[3].destination = (addr[0], addr[1] + 1)
+
+    def set_target_media(self, addr):
+        """Media from leg A goes to the target's RTP/RTCP ports"""
+        self.paths[0].destination = addr
+        self.paths[1].destination = (addr[0], addr[1] + 1)
+
+class RtpRelay:
+    """
+    Back-to-back user agent relaying calls from its SIP port to one target.
+    """
+
+    def __init__(self, local_ip, local_port, target_ip, target_port, port_pool=None):
+        self.local_ip = local_ip
+        self.local_port = int(local_port)
+        self.target_addr = (target_ip, int(target_port))
+        self.owns_port_pool = port_pool is None
+        self.port_pool = PortPool(local_ip) if self.owns_port_pool else port_pool
+        self.calls = {}  # Call-ID of either dialog -> RelayCall
+        self.running = False
+
+        self.sip_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sip_socket.bind((self.local_ip, self.local_port))
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sip_socket, selectors.EVENT_READ, None)
+
+    def run(self):
+        """Serve SIP and forward media until stopped"""
+        self.running = True
+        print(f"[Relay] Relaying calls on {self.local_ip}:{self.local_port} to "
+              f"{self.target_addr[0]}:{self.target_addr[1]}")
+        try:
+            while self.running:
+                for key, _ in self.selector.select(timeout=0.5):
+                    try:
+                        if key.data is None:
+                            data, addr = self.sip_socket.recvfrom(2048)
+                            self._handle_sip(data.decode(errors='replace'), addr)
+                        else:
+                            key.data.forward()
+                    except OSError as e:
+                        # ICMP errors from a peer that went away surface here
+                        if self.running:
+                            print(f"[Relay] Socket error: {e}")
+                    except Exception as e:
+                        # One bad message must not end the calls being relayed
+                        if self.running:
+                            print(f"[Relay] Error handling message: {e}")
+        finally:
+            for call in set(self.calls.values()):
+                self._release_call(call)
+            if self.owns_port_pool:
+                self.port_pool.close()
+            self.sip_socket.close()
+
+    def stop(self):
+        """Ask the relay loop to exit"""
+        self.running = False
+
+    def _handle_sip(self, message, addr):
+        """Drive both dialogs of a call from messages on either side"""
+        headers, media = {}, None
+        media_ip = addr[0]
+        for line in message.split('\n'):
+            name, _, value = line.partition(':')
+            if name.strip().lower() in ('call-id', 'cseq'):
+                headers[name.strip().lower()] = value.strip()
+            elif line.startswith('c=IN IP4'):
+                media_ip = line.split()[2]
+            elif line.startswith('m=audio'):
+                media = (media_ip, int(line.split()[1]))
+
+        call_id = headers.get('call-id')
+        if call_id is None:
+            return
+        cseq = int(headers.get('cseq', '0').split()[0])
+        call = self.calls.get(call_id)
+
+        if message.startswith('INVITE') and call is None and media:
+            leg_a = self.port_pool.allocate()
+            try:
+                leg_b = self.port_pool.allocate()
+            except RuntimeError:
+                self.port_pool.release(leg_a)
+                raise
+            call = RelayCall(call_id, addr, cseq, leg_a, leg_b)
+            call.set_caller_media(media)
+            self.calls[call.caller_call_id] = call
+            self.calls[call.target_call_id] = call
+            for path in call.paths:
+                self.selector.register(path.in_socket, selectors.EVENT_READ, path)
+
+            invite = SipPacket()
+            invite.create_invite(self.local_ip, self.target_addr[0], call.target_call_id, 1,
+                                 self._create_sdp(call.target_call_id, call.leg_b.rtp_port))
+            self.sip_socket.sendto(invite.encode(), self.target_addr)
+            print(f"[Relay] Call {call_id}: caller leg port {call.leg_a.rtp_port}, "
+                  f"target leg port {call.leg_b.rtp_port}")
+
+        elif message.startswith('SIP/2.0 200') and call and call_id == call.target_call_id and media:
+            if call.paths[0].destination is not None:
+                return  # Retransmitted answer
+            call.set_target_media(media)
+            self._send_request('ACK', call.target_call_id, cseq, self.target_addr)
+
+            response = SipPacket()
+            response.create_response(200)
+            response.from_addr = self.local_ip
+            response.call_id = call.caller_call_id
+            response.cseq = call.caller_cseq
+            response.content_type = "application/sdp"
+            response.content = self._create_sdp(call.caller_call_id, call.leg_a.rtp_port)
+            self.sip_socket.sendto(response.encode(), call.caller_addr)
+            print(f"[Relay] Call {call.caller_call_id}: both legs connected")
+
+        elif message.startswith('BYE') and call:
+            # Answer this side and end the other dialog
+            response = SipPacket()
+            response.create_response(200)
+            response.from_addr = self.local_ip
+            response.call_id = call_id
+            response.cseq = cseq
+            self.sip_socket.sendto(response.encode(), addr)
+
+            if call_id == call.caller_call_id:
+                self._send_request('BYE', call.target_call_id, 2, self.target_addr)
+            else:
+                self._send_request('BYE', call.caller_call_id, call.caller_cseq + 1, call.caller_addr)
+            self._release_call(call)
+            print(f"[Relay] Call {call.caller_call_id} ended")
+
+    def _send_request(self, method, call_id, cseq, addr):
+        """Send a body-less request (ACK or BYE) within a dialog"""
+        request = SipPacket()
+        request.method = method
+        request.call_id = call_id
+        request.cseq = cseq
+        request.from_addr = self.local_ip
+        request.to_addr = addr[0]
+        self.sip_socket.sendto(request.encode(), addr)
+
+    def _create_sdp(self, session_id, rtp_port):
+        """Create SDP pointing one leg at the relay"""
+        sdp = "v=0\r\n"
+        sdp += f"o=- {session_id} 1 IN IP4 {self.local_ip}\r\n"
+        sdp += "s=Audio Call\r\n"
+        sdp += f"c=IN IP4 {self.local_ip}\r\n"
+        sdp += "t=0 0\r\n"
+        sdp += f"m=audio {rtp_port} RTP/AVP 0\r\n"
+        sdp += "a=rtpmap:0 PCMU/8000\r\n"
+        return sdp
+
+    def _release_call(self, call):
+        """Stop forwarding a call and release both legs"""
+        self.calls.pop(call.caller_call_id, None)
+        self.calls.pop(call.target_call_id, None)
+        for path in call.paths:
+            try:
+                self.selector.unregister(path.in_socket)
+            except (KeyError, ValueError):
+                pass
+        self.port_pool.release(call.leg_a)
+        self.port_pool.release(call.leg_b)
+
+def _forward_only(paths, duration, results):
+    """Benchmark worker: forward packets on `paths` and report CPU cost"""
+    selector = selectors.DefaultSelector()
+    for path in paths:
+        selector.register(path.in_socket, selectors.EVENT_READ, path)
+
+    cpu_start = time.process_time()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        for key, _ in selector.select(timeout=0.1):
+            key.data.forward()
+    results.put((sum(path.forwarded for path in paths), time.process_time() - cpu_start))
+
+def _latency_samples(send_socket, sink, destination, count=200, interval=0.005):
+    """Send timestamped packets and return one-way delays in seconds"""
+    header = bytearray(12)
+    header[0] = 0x80
+    delays = []
+    for seq_num in range(count):
+        struct.pack_into('!H', header, 2, seq_num)
+        send_socket.sendto(bytes(header) + struct.pack('!d', time.perf_counter()) + bytes(152), destination)
+        try:
+            data = sink.recv(BUFFER_SIZE)
+            delays.append(time.perf_counter() - struct.unpack_from('!d', data, 12)[0])
+        except socket.timeout:
+            pass
+        time.sleep(interval)
+    delays.sort()
+    return delays
+
+def benchmark(seconds=5.0, local_ip='127.0.0.1'):
+    """Measure forwarded packets per CPU-second and the latency the relay adds"""
+    pool = PortPool(local_ip)
+    leg_a, leg_b = pool.allocate(), pool.allocate()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind((local_ip, 0))
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind((local_ip, 0))
+    sink.settimeout(0.5)
+    sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+
+    path = MediaPath(leg_a.rtp_socket, leg_b.rtp_socket, HeaderRewriter())
+    path.destination = sink.getsockname()
+    context = multiprocessing.get_context('fork')
+
+    print(f"\n[Benchmark] RTP relay forwarding ({seconds:.0f} s, 172-byte packets)")
+    print("─" * 56)
+
+    # Added latency: direct path versus through the relay
+    direct = _latency_samples(sender, sink, sink.getsockname())
+    results = context.Queue()
+    relay = context.Process(target=_forward_only, args=([path], 3.0, results))
+    relay.start()
+    time.sleep(0.2)
+    relayed = _latency_samples(sender, sink, (local_ip, leg_a.rtp_port))
+    relay.join()
+    results.get()
+    if direct and relayed:
+        added = (relayed[len(relayed) // 2] - direct[len(direct) // 2]) * 1e6
+        added_p99 = (relayed[int(len(relayed) * 0.99) - 1] - direct[int(len(direct) * 0.99) - 1]) * 1e6
+        print(f"Added latency: p50 {added:.0f} us, p99 {added_p99:.0f} us")
+
+    # Throughput: flood the relay and normalise by its CPU time
+    relay = context.Process(target=_forward_only, args=([path], seconds, results))
+    relay.start()
+    packet = bytes([0x80, 0]) + bytes(170)
+    deadline = time.perf_counter() + seconds - 0.5
+    sent = 0
+    while time.perf_counter() < deadline:
+        for _ in range(64):
+            sender.sendto(packet, (local_ip, leg_a.rtp_port))
+        sent += 64
+        time.sleep(0)
+    relay.join()
+    forwarded, cpu_time = results.get()
+
+    print(f"Packets offered: {sent:,}")
+    print(f"Packets forwarded: {forwarded:,}")
+    if cpu_time > 0:
+        print(f"Forwarded per CPU-second: {forwarded / cpu_time:,.0f} packets/s per core")
+        print(f"Concurrent 50 pps streams per core: {forwarded / cpu_time / 50:,.0f}")
+    print("─" * 56)
+
+    for sock in (sender, sink):
+        sock.close()
+    pool.release(leg_a)
+    pool.release(leg_b)
+    pool.close()
+
+if __name__ == "__main__":
+    benchmark(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0)
@@ -0,0 +1,370 @@
+import multiprocessing
+import os
+import queue
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from AudioClient_CoTan import AudioClient
+from PortPool_CoTan import PortPool
+
+"""
+Multi-process SIP receiver
+
+N worker processes bind the same SIP port with SO_REUSEPORT so the kernel
+spreads incoming datagrams across them. The kernel hashes on addresses, not on
+Call-ID, so every worker checks which worker owns a message's Call-ID and
+hands it over when it is not its own. Each worker draws media ports from its
+own slice of the RTP range, so workers never compete for a port.
+
+Benchmark usage:
+    SipWorkers_CoTan.py [max_workers] [max_calls]
+"""
+
+HANDOFF_SIZE = 4096
+
+def parse_call_id(message):
+    """Return the Call-ID header value of a SIP message, or None"""
+    for line in message.split('\n'):
+        if line.lower().startswith('call-id:'):
+            return line.split(':', 1)[1].strip()
+    return None
+
+def owner_of(call_id, workers):
+    """Return the index of the worker that owns a Call-ID"""
+    return zlib.crc32(call_id.encode()) % workers
+
+def split_port_range(port_min, port_max, workers):
+    """Split an RTP port range into disjoint, even-aligned slices"""
+    first = port_min + (port_min % 2)
+    pairs = (port_max - first + 1) // 2
+    per_worker = pairs // workers
+    if per_worker < 1:
+        raise ValueError(f"Port range {port_min}-{port_max} too small for {workers} workers")
+    return [(first + i * per_worker * 2, first + (i + 1) * per_worker * 2 - 1)
+            for i in range(workers)]
+
+class SipWorker:
+    """
+    One SIP worker process owning the dialogs whose Call-ID hashes to it.
+
+    Attributes:
+        index (int): Position of this worker in the pool
+        dialogs (dict): Call-ID to AudioClient for dialogs owned by this worker
+    """
+
+    def __init__(self, index, local_ip, local_port, port_range, handoff_sockets, headless=False,
+                 record_path=None, latency_probe=False, stats=None):
+        self.index = index
+        self.local_ip = local_ip
+        self.local_port = local_port
+        self.port_range = port_range
+        self.handoff_sockets = handoff_sockets  # (receive, send) pair per worker
+        self.headless = headless
+        self.record_path = record_path
+        self.latency_probe = latency_probe
+        self.stats = stats  # Optional queue receiving (Call-ID, packets played) per ended dialog
+        self.dialogs = {}
+        self.running = True
+
+    def run(self):
+        """Serve SIP messages until interrupted"""
+        self.sip_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sip_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sip_socket.bind((self.local_ip, self.local_port))
+        self.port_pool = PortPool(self.local_ip, *self.port_range)
+        handoff_in = self.handoff_sockets[self.index][0]
+
+        print(f"[Worker {self.index}] Serving SIP on {self.local_ip}:{self.local_port}, "
+              f"RTP ports {self.port_range[0]}-{self.port_range[1]}")
+
+        selector = selectors.DefaultSelector()
+        selector.register(self.sip_socket, selectors.EVENT_READ)
+        selector.register(handoff_in, selectors.EVENT_READ)
+
+        try:
+            while self.running:
+                for key, _ in selector.select(timeout=1.0):
+                    try:
+                        if key.fileobj is self.sip_socket:
+                            data, addr = self.sip_socket.recvfrom(2048)
+                            self._route(data, addr)
+                        else:
+                            self._receive_handoff(handoff_in.recv(HANDOFF_SIZE))
+                    except Exception as e:
+                        print(f"[Worker {self.index}] Error handling message: {e}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for client in list(self.dialogs.values()):
+                client.cleanup(send_bye=False)
+            self.port_pool.close()
+            self.sip_socket.close()
+
+    def _route(self, data, addr):
+        """Handle a message locally or hand it to the worker owning its Call-ID"""
+        call_id = parse_call_id(data.decode(errors='replace'))
+        if call_id is None:
+            return
+
+        owner = owner_of(call_id, len(self.handoff_sockets))
+        if owner == self.index:
+            self._dispatch(data.decode(), addr)
+        else:
+            # Prefix the original source so the owner can answer it directly
+            header = f"{addr[0]}:{addr[1]}\n".encode()
+            self.handoff_sockets[owner][1].send(header + data)
+
+    def _receive_handoff(self, packet):
+        """Unpack a message handed over by another worker"""
+        header, _, data = packet.partition(b'\n')
+        ip, _, port = header.decode().rpartition(':')
+        self._dispatch(data.decode(), (ip, int(port)))
+
+    def _dispatch(self, message, addr):
+        """Deliver a message to the dialog that owns its Call-ID"""
+        call_id = parse_call_id(message)
+        client = self.dialogs.get(call_id)
+
+        if client is None:
+            if not message.startswith('INVITE'):
+                return
+            client = AudioClient(self.local_ip, self.local_port, addr[0], addr[1],
+                                 'receiver', port_pool=self.port_pool,
+                                 sip_socket=self.sip_socket, headless=self.headless,
+                                 record_path=self.record_path, latency_probe=self.latency_probe)
+            self.dialogs[call_id] = client
+
+        client.handle_sip_message(message, addr)
+
+        if message.startswith('BYE'):
+            del self.dialogs[call_id]
+            # Thread joins in cleanup take a while; keep the SIP loop responsive
+            threading.Thread(target=self._end_dialog, args=(call_id, client), daemon=True).start()
+
+    def _end_dialog(self, call_id, client):
+        """Release an ended dialog and report how much of its media was played"""
+        client.cleanup(send_bye=False)
+        if self.stats is not None:
+            self.stats.put((call_id, client.packets_played))
+
+class SipWorkerPool:
+    """
+    Starts and supervises SipWorker processes sharing one SIP port.
+
+    Attributes:
+        workers (int): Number of worker processes
+        port_ranges (list): Disjoint (min, max) RTP port range per worker
+    """
+
+    def __init__(self, local_ip, local_port, workers, port_min=None, port_max=None,
+                 headless=False, record_path=None, latency_probe=False, stats=None):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("SO_REUSEPORT is not supported on this platform")
+        if port_min is None:
+            port_min = PortPool.DEFAULT_RANGE[0]
+        if port_max is None:
+            port_max = PortPool.DEFAULT_RANGE[1]
+
+        self.local_ip = local_ip
+        self.local_port = int(local_port)
+        self.workers = int(workers)
+        self.port_ranges = split_port_range(port_min, port_max, self.workers)
+        self.headless = headless
+        self.record_path = record_path
+        self.latency_probe = latency_probe
+        self.stats = stats
+        self.processes = []
+
+    def start(self):
+        """Fork the worker processes"""
+        # Fork so every worker inherits the send end of every handoff channel
+        context = multiprocessing.get_context('fork')
+        handoff_sockets = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+                           for _ in range(self.workers)]
+
+        for index in range(self.workers):
+            worker = SipWorker(index, self.local_ip, self.local_port,
+                               self.port_ranges[index], handoff_sockets, self.headless,
+                               self.record_path, self.latency_probe, self.stats)
+            process = context.Process(target=worker.run, daemon=True)
+            process.start()
+            self.processes.append(process)
+
+        print(f"[SIP] Started {self.workers} workers on {self.local_ip}:{self.local_port}")
+
+    def stop(self):
+        """Terminate all worker processes"""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=2.0)
+        self.processes = []
+
+def _run_calls(local_ip, target_port, calls, call_rate, hold_time, results):
+    """
+    Place calls at a fixed rate and stream 20 ms RTP on every established one.
+
+    Each call keeps sending media until hold_time after the last call was
+    placed, so later call setups compete with the media of earlier calls.
+    Puts {call_id: (setup latency or None, RTP packets sent)} on results.
+    """
+    selector = selectors.DefaultSelector()
+    rtp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rtp_socket.bind((local_ip, 0))
+    packet = bytearray(12 + 320)
+    packet[0] = 0x80
+
+    sockets = {}
+    invite_times = {}
+    established = {}  # Call-ID -> (setup latency, RTP port)
+    sent = {}
+    started = time.perf_counter()
+    hold_end = started + calls / call_rate + hold_time
+    next_tick = started
+    placed = 0
+    seq_num = 0
+
+    while time.perf_counter() < hold_end:
+        now = time.perf_counter()
+        while placed < calls and now >= started + placed / call_rate:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((local_ip, 0))
+            sock.setblocking(False)
+            call_id = f"bench-{os.getpid()}-{placed}"
+            sdp = (f"v=0\r\nc=IN IP4 {local_ip}\r\nt=0 0\r\n"
+                   f"m=audio {rtp_socket.getsockname()[1]} RTP/AVP 0\r\n")
+            invite = (f"INVITE sip:{local_ip} SIP/2.0\r\nCall-ID: {call_id}\r\nCSeq: 1 INVITE\r\n"
+                      f"Content-Type: application/sdp\r\nContent-Length: {len(sdp)}\r\n\r\n{sdp}")
+            invite_times[call_id] = time.perf_counter()
+            sock.sendto(invite.encode(), (local_ip, target_port))
+            selector.register(sock, selectors.EVENT_READ, call_id)
+            sockets[call_id] = sock
+            sent[call_id] = 0
+            placed += 1
+
+        # Collect 200 OK answers and the RTP port each dialog allocated
+        for key, _ in selector.select(timeout=max(next_tick - time.perf_counter(), 0)):
+            data = key.fileobj.recv(2048).decode(errors='replace')
+            if data.startswith('SIP/2.0 200') and key.data not in established and 'm=audio ' in data:
+                rtp_port = int(data.split('m=audio ')[1].split()[0])
+                established[key.data] = (time.perf_counter() - invite_times[key.data], rtp_port)
+                ack = f"ACK sip:{local_ip} SIP/2.0\r\nCall-ID: {key.data}\r\nCSeq: 2 ACK\r\nContent-Length: 0\r\n\r\n"
+                key.fileobj.sendto(ack.encode(), (local_ip, target_port))
+
+        if time.perf_counter() >= next_tick:
+            # One 160-sample packet per established call every 20 ms
+            struct.pack_into('!HI', packet, 2, seq_num & 0xFFFF, (seq_num * 160) & 0xFFFFFFFF)
+            for call_id, (_, rtp_port) in established.items():
+                rtp_socket.sendto(packet, (local_ip, rtp_port))
+                sent[call_id] += 1
+            seq_num += 1
+            next_tick += 0.02
+
+    for call_id, sock in sockets.items():
+        bye = f"BYE sip:{local_ip} SIP/2.0\r\nCall-ID: {call_id}\r\nCSeq: 3 BYE\r\nContent-Length: 0\r\n\r\n"
+        sock.sendto(bye.encode(), (local_ip, target_port))
+        sock.close()
+    rtp_socket.close()
+
+    results.put({call_id: (established[call_id][0] if call_id in established else None, sent[call_id])
+                 for call_id in sent})
+
+def _measure(workers, calls, call_rate, hold_time, generators, local_ip, port):
+    """Offer one load level to a fresh worker pool and return what held up"""
+    context = multiprocessing.get_context('fork')
+    stats = context.Queue()
+    pool = SipWorkerPool(local_ip, port, workers, headless=True, stats=stats)
+    # Keep per-packet logging from dominating the measurement
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        pool.start()
+    finally:
+        sys.stdout = stdout
+    time.sleep(0.5)
+
+    results = context.Queue()
+    procs = [context.Process(target=_run_calls,
+                             args=(local_ip, port, calls // generators,
+                                   call_rate / generators, hold_time, results))
+             for _ in range(generators)]
+    for proc in procs:
+        proc.start()
+    offered = {}
+    for _ in procs:
+        offered.update(results.get())
+    for proc in procs:
+        proc.join()
+
+    # Workers report packets played per dialog once its BYE is processed
+    latencies = sorted(latency for latency, _ in offered.values() if latency is not None)
+    played = {}
+    deadline = time.time() + 10.0 + len(latencies) / 50
+    while len(played) < len(latencies) and time.time() < deadline:
+        try:
+            call_id, packets = stats.get(timeout=max(deadline - time.time(), 0.1))
+            played[call_id] = packets
+        except queue.Empty:
+            break
+    pool.stop()
+
+    total_sent = sum(sent for latency, sent in offered.values() if latency is not None)
+    return {
+        'offered': len(offered),
+        'established': len(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1] * 1000 if latencies else None,
+        'delivery': sum(played.values()) / total_sent if total_sent else 0.0,
+        'sustained': sum(1 for call_id, (latency, sent) in offered.items()
+                         if latency is not None and sent and played.get(call_id, 0) >= 0.95 * sent),
+    }
+
+def benchmark(max_workers=4, start_calls=100, max_calls=1600, call_rate=100.0, hold_time=5.0,
+              generators=2, local_ip='127.0.0.1', port=5090):
+    """
+    Find how many concurrent calls with media 1..max_workers workers sustain.
+
+    For each worker count the offered load starts at `start_calls` and
+    doubles until fewer than 95% of the calls are sustained (a call is
+    sustained when its receiver played at least 95% of the packets sent) or
+    `max_calls` is reached. Calls arrive at `call_rate` per second from
+    `generators` processes and stream 50 packets per second until the end of
+    the hold. Capacity is the largest load that still held.
+    """
+    print(f"\n[Benchmark] Concurrent calls with media ({call_rate:g} calls/s, "
+          f"held {hold_time:g} s, 50 pps each)")
+    print("─" * 72)
+    print(f"{'Workers':>8} {'Offered':>8} {'Established':>12} {'p95 ms':>8} "
+          f"{'RTP played':>11} {'Sustained':>10}")
+
+    capacities = {}
+    workers = 1
+    while workers <= max_workers:
+        capacity = 0
+        calls = start_calls
+        while calls <= max_calls:
+            result = _measure(workers, calls, call_rate, hold_time, generators, local_ip, port)
+            p95 = f"{result['p95']:.1f}" if result['p95'] is not None else '-'
+            print(f"{workers:>8} {result['offered']:>8} {result['established']:>12} {p95:>8} "
+                  f"{result['delivery']:>10.1%} {result['sustained']:>10}")
+            time.sleep(2.5)  # Let released ports leave quarantine
+            if result['sustained'] < 0.95 * result['offered']:
+                break
+            capacity = result['offered']
+            calls *= 2
+        capacities[workers] = capacity
+        workers *= 2
+
+    print("─" * 72)
+    for workers, capacity in capacities.items():
+        limit = f"{capacity}" if capacity else f"< {start_calls}"
+        print(f"{workers} worker(s): capacity {limit} concurrent calls"
+              f"{' (ramp limit reached)' if capacity and capacity * 2 > max_calls else ''}")
+
+if __name__ == "__main__":
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    max_calls = int(sys.argv[2]) if len(sys.argv) > 2 else 1600
+    benchmark(max_workers, max_calls=max_calls)